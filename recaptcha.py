@@ -14,23 +14,56 @@
 ################################################################################
 """reCAPTCHA client."""
 
+from array import array
+from cgi import escape as html_escape
+from collections import deque
+from errno import ECONNABORTED
+from errno import ECONNRESET
+from errno import EPIPE
+from hashlib import sha1
+from httplib import HTTPConnection
+from httplib import HTTPSConnection
 from json import dumps as json_encode
+from json import loads as json_decode
+from optparse import OptionParser
+from os import makedirs
+from os import path
+from os import rename
+from Queue import Empty
+from Queue import Queue
+from socket import _GLOBAL_DEFAULT_TIMEOUT
+from socket import error as SocketError
+from socket import timeout as SocketTimeout
+from threading import Event
+from threading import Lock
+from threading import Thread
+from time import time
+from urllib import getproxies
+from urllib import proxy_bypass
+from urllib import quote as url_quote
+from urllib import quote_plus as url_quote_plus
 from urllib import urlencode
-from urllib2 import Request
-from urllib2 import URLError
-from urllib2 import urlopen
 from urlparse import urljoin
 from urlparse import urlsplit
 from urlparse import urlunsplit
+import sys
+import zlib
 
 
 __all__ = [
+    'HedgingStatistics',
     'RECAPTCHA_CHARACTER_ENCODING',
+    'RecaptchaAuditLog',
+    'RecaptchaChallengeGate',
     'RecaptchaClient',
     'RecaptchaException',
     'RecaptchaInvalidChallengeError',
     'RecaptchaInvalidPrivateKeyError',
-    'RecaptchaUnreachableError'
+    'RecaptchaInvalidResponseError',
+    'RecaptchaUnreachableError',
+    'RecaptchaVerificationProtocol',
+    'RecaptchaVerificationResponseParser',
+    'VerificationResult',
     ]
 
 
@@ -40,6 +73,7 @@ _RECAPTCHA_API_URL = 'http://www.google.com/recaptcha/api/'
 _RECAPTCHA_VERIFICATION_RELATIVE_URL_PATH = 'verify'
 _RECAPTCHA_JAVASCRIPT_CHALLENGE_RELATIVE_URL_PATH = 'challenge'
 _RECAPTCHA_NOSCRIPT_CHALLENGE_RELATIVE_URL_PATH = 'noscript'
+_RECAPTCHA_JAVASCRIPT_API_RELATIVE_URL_PATH = 'js/recaptcha_ajax.js'
 
 
 RECAPTCHA_CHARACTER_ENCODING = 'UTF-8'
@@ -84,12 +118,146 @@ _RECAPTCHA_CHALLENGE_MARKUP_TEMPLATE = """
 """
 
 
+_RECAPTCHA_MINIFIED_NOSCRIPT_MARKUP_TEMPLATE = (
+    '<noscript>'
+    '<iframe src="{noscript_challenge_url}" height="300" width="500" '
+    'frameborder="0"></iframe><br />'
+    '<textarea name="recaptcha_challenge_field" rows="3" cols="40"></textarea>'
+    '<input type="hidden" name="recaptcha_response_field" '
+    'value="manual_challenge" />'
+    '</noscript>'
+    )
+
+
+_RECAPTCHA_ASYNCHRONOUS_CHALLENGE_MARKUP_TEMPLATE = (
+    '<div id="{widget_element_id}"></div>'
+    '<script type="text/javascript">'
+    'var RecaptchaOptions={recaptcha_options_json};{extra_options_javascript}'
+    '</script>'
+    '<script type="text/javascript" src="{javascript_api_url}" async="async" '
+    'defer="defer" onload="{onload_javascript}"></script>'
+    ) + _RECAPTCHA_MINIFIED_NOSCRIPT_MARKUP_TEMPLATE
+
+
+# The reCAPTCHA AJAX API supports a single widget per page, so the loader
+# creates it in the placeholder of the form the user is about to fill in and
+# moves it whenever the user switches forms. The API itself is only loaded when
+# the widget is first needed.
+_RECAPTCHA_CHALLENGE_LOADER_MARKUP_TEMPLATE = (
+    '<script type="text/javascript">'
+    'var RecaptchaOptions={recaptcha_options_json};{extra_options_javascript}'
+    '(function(){{'
+    'var d=document,k=null,l=0;'
+    'function c(){{'
+    'if(window.Recaptcha){{'
+    'Recaptcha.create({public_key_json},k,RecaptchaOptions)'
+    '}}else if(!l){{'
+    'l=1;var s=d.createElement("script");'
+    's.src={javascript_api_url_json};s.async=true;s.onload=c;'
+    'd.getElementsByTagName("head")[0].appendChild(s)'
+    '}}'
+    '}}'
+    'd.addEventListener("focus",function(e){{'
+    'var f=e.target.form,w=f&&f.querySelector(".{placeholder_class_name}");'
+    'if(w&&w.id!==k){{k=w.id;c()}}'
+    '}},true)'
+    '}})();'
+    '</script>'
+    )
+
+
+_RECAPTCHA_CHALLENGE_PLACEHOLDER_MARKUP_TEMPLATE = (
+    '<div id="{widget_element_id}" class="{placeholder_class_name}"></div>'
+    ) + _RECAPTCHA_MINIFIED_NOSCRIPT_MARKUP_TEMPLATE
+
+
+_RECAPTCHA_CHALLENGE_PLACEHOLDER_CLASS_NAME = 'recaptcha_placeholder'
+
+
+_RECAPTCHA_WIDGET_ELEMENT_ID = 'recaptcha_widget'
+
+
+_CHALLENGE_MARKUP_RENDERING_COMMAND_DESCRIPTION = (
+    'Write every variant of the challenge markup for the public keys and '
+    'reCAPTCHA options profiles given, so that it can be served as a static or '
+    'edge-side include. The files for each public key and options profile are '
+    'written to DIRECTORY/PUBLIC_KEY/PROFILE_NAME/ and their names contain a '
+    'hash of their contents. A manifest.json file maps each variant to the '
+    'file it was written to.'
+    )
+
+
+_DEFAULT_RECAPTCHA_OPTIONS_PROFILE_NAME = 'default'
+
+
+_CHALLENGE_MARKUP_COMPRESSORS = {
+    'gzip': lambda: zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+    'deflate': lambda: zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS),
+    }
+
+
+_API_ENDPOINT_LATENCY_SMOOTHING_FACTOR = 0.2
+_API_ENDPOINT_ERROR_RATE_SMOOTHING_FACTOR = 0.2
+_API_ENDPOINT_ERROR_RATE_HALF_LIFE = 60
+_API_ENDPOINT_ERROR_PENALTY = 10
+
+
+# Each API gets an equal share of the time left to verify a solution, but no
+# less than this number of seconds (unless less time is left)
+_MINIMUM_API_ATTEMPT_TIMEOUT = 0.5
+
+
+_AUDIT_LOG_DROP_POLICIES = ('drop-newest', 'drop-oldest')
+
+
+_AUDIT_LOG_RECORD_TEMPLATE = \
+    '{timestamp:.3f}\t{remote_ip}\t{outcome:d}\t{error_code}\n'
+
+
+# Counters are rescaled once the weight of new events reaches 2 ** 20, which
+# keeps them far from the limits of double precision
+_SKETCH_MAXIMUM_WEIGHT_EXPONENT = 20
+
+
+# Counts which have decayed for this many half-lives are indistinguishable from
+# zero, and computing their weight would overflow a double soon after
+_SKETCH_EXPIRY_EXPONENT = 1000
+
+
+_DEFAULT_VERIFICATION_PARALLELISM = 8
+
+
+_MAXIMUM_IDLE_CONNECTIONS_PER_HOST = 16
+
+
+# Hedges not used while reCAPTCHA is fast are saved for later, up to this many
+_MAXIMUM_HEDGE_BURST = 5
+
+
 _CLIENT_USER_AGENT = \
     'reCAPTCHA Client by 2degrees (http://packages.python.org/recaptcha/)'
 
 
+_VERIFICATION_REQUEST_HEAD_PREFIX_TEMPLATE = (
+    'POST {url_path} HTTP/1.1\r\n'
+    'Host: {host}\r\n'
+    'User-Agent: {user_agent}\r\n'
+    'Content-Type: application/x-www-form-urlencoded\r\n'
+    'Content-Length: '
+    )
+
+
+_MAXIMUM_VERIFICATION_RESPONSE_HEAD_SIZE = 64 * 1024
+
+
+_VERIFICATION_RESPONSE_READ_SIZE = 4096
+
+
+_CLOSED_CONNECTION_ERRNOS = (ECONNABORTED, ECONNRESET, EPIPE)
+
+
 class RecaptchaClient(object):
-    """Stateless reCAPTCHA client."""
+    """Thread-safe reCAPTCHA client."""
 
     def __init__(
         self,
@@ -97,6 +265,11 @@ class RecaptchaClient(object):
         public_key,
         recaptcha_options=None,
         verification_timeout=None,
+        api_urls=None,
+        audit_log=None,
+        hedging_delay=None,
+        hedging_ratio=0.05,
+        verify_over_ssl=True,
         ):
         """
 
@@ -109,10 +282,47 @@ class RecaptchaClient(object):
         :param verification_timeout: Maximum number of seconds to wait for
             reCAPTCHA to respond to a verification request
         :type verification_timeout: :class:`int`
+        :param api_urls: Base URLs of equivalent reCAPTCHA APIs, in order of
+            preference
+        :type api_urls: iterable of :class:`str`
+        :param audit_log: Log where the outcome of every verification will be
+            recorded
+        :type audit_log: :class:`RecaptchaAuditLog`
+        :param hedging_delay: Number of seconds after which a second request is
+            sent to reCAPTCHA if the first one hasn't been answered yet, or
+            ``None`` to disable hedging
+        :type hedging_delay: :class:`float`
+        :param hedging_ratio: Maximum proportion of verification requests that
+            can be hedged
+        :type hedging_ratio: :class:`float`
+        :param verify_over_ssl: Whether solutions are verified over HTTPS,
+            which should only be disabled to verify them with a local
+            stand-in for reCAPTCHA (e.g., in load tests)
+        :type verify_over_ssl: :class:`bool`
 
         When ``verification_timeout`` is ``None``, the default socket timeout
         will be used. See :meth:`is_solution_correct`.
 
+        The challenge markup is always generated with the first URL in
+        ``api_urls``. Solutions are verified with the API which has been the
+        fastest and the most reliable recently; if it can't be reached, the
+        remaining APIs are tried in turn until one responds or the
+        ``verification_timeout`` is exceeded. Each API is given an equal share
+        of the time left, so that an API which doesn't respond can't use up
+        the whole ``verification_timeout``.
+
+        Hedging cuts the latency of the slowest verifications, which are
+        usually caused by a few slow responses from reCAPTCHA: When
+        ``hedging_delay`` is set (e.g., to the 95th percentile of the
+        verification latency), the request is sent again over a different
+        connection if there's no response after that delay, and the first
+        response received is used. Because challenges can only be verified
+        once, a response that reports the solution as incorrect is only used
+        once the other request has completed. To limit the additional load on
+        reCAPTCHA, no more than ``hedging_ratio`` of the requests are hedged,
+        with bursts of at most five hedges above that ratio. The effect of
+        hedging is reported in :attr:`hedging_statistics`.
+
         """
         super(RecaptchaClient, self).__init__()
 
@@ -120,40 +330,224 @@ class RecaptchaClient(object):
         self.public_key = public_key
 
         self.recaptcha_options_json = json_encode(recaptcha_options or {})
+        self._minified_recaptcha_options_json = json_encode(
+            recaptcha_options or {},
+            separators=(',', ':'),
+            )
 
         self.verification_timeout = verification_timeout
 
+        self.api_urls = tuple(api_urls or (_RECAPTCHA_API_URL,))
+        self._api_endpoints = [
+            _RecaptchaAPIEndpoint(api_url, verify_over_ssl)
+            for api_url in self.api_urls
+            ]
+        self._verification_protocols_by_api_url = dict(
+            (api_url, RecaptchaVerificationProtocol(private_key, api_url))
+            for api_url in self.api_urls
+            )
+
+        self.audit_log = audit_log
+
+        self._connection_pool = _HTTPConnectionPool()
+
+        self.hedging_delay = hedging_delay
+        self.hedging_ratio = hedging_ratio
+        self.hedging_statistics = HedgingStatistics()
+
+        self._challenge_markup_cache = {}
+
     def get_challenge_markup(
         self,
         was_previous_solution_incorrect=False,
         use_ssl=False,
+        load_asynchronously=False,
         ):
         """
         Return the X/HTML code to present a challenge.
 
+        :type was_previous_solution_incorrect: :class:`bool`
+        :param use_ssl: Whether to generate the markup with HTTPS URLs instead
+            of HTTP ones
+        :type use_ssl: :class:`bool`
+        :param load_asynchronously: Whether to generate minified markup which
+            loads the reCAPTCHA JavaScript API without blocking the rendering
+            of the page
+        :type load_asynchronously: :class:`bool`
+        :rtype: :class:`str`
+
+        When ``load_asynchronously`` is ``True``, the challenge is created
+        once the reCAPTCHA AJAX API has been loaded, using the ``async`` and
+        ``defer`` attributes of the ``script`` element.
+
+        Each variant of the markup is only generated once per client.
+
+        This method does not communicate with the remote reCAPTCHA API.
+
+        """
+        challenge_markup_variant = (
+            was_previous_solution_incorrect,
+            use_ssl,
+            load_asynchronously,
+            None,
+            )
+        challenge_markup = \
+            self._challenge_markup_cache.get(challenge_markup_variant)
+        if challenge_markup is None:
+            challenge_markup = self._get_uncached_challenge_markup(
+                was_previous_solution_incorrect,
+                use_ssl,
+                load_asynchronously,
+                )
+            self._challenge_markup_cache[challenge_markup_variant] = \
+                challenge_markup
+        return challenge_markup
+
+    def get_compressed_challenge_markup(
+        self,
+        content_coding,
+        was_previous_solution_incorrect=False,
+        use_ssl=False,
+        load_asynchronously=False,
+        ):
+        """
+        Return the X/HTML code to present a challenge, compressed with
+        ``content_coding``.
+
+        :param content_coding: The HTTP content coding to use: ``gzip`` or
+            ``deflate``
+        :type content_coding: :class:`str`
+        :rtype: :class:`str`
+        :raises ValueError: If ``content_coding`` is not supported
+
+        The rest of the arguments are the same as in
+        :meth:`get_challenge_markup`.
+
+        The compressed markup is deterministic, so it can be stored by fragment
+        caches and served as is with the corresponding ``Content-Encoding``.
+        Each variant is only compressed once per client.
+
+        """
+        if content_coding not in _CHALLENGE_MARKUP_COMPRESSORS:
+            raise ValueError(
+                'Unsupported content coding {0!r}'.format(content_coding),
+                )
+
+        challenge_markup_variant = (
+            was_previous_solution_incorrect,
+            use_ssl,
+            load_asynchronously,
+            content_coding,
+            )
+        compressed_challenge_markup = \
+            self._challenge_markup_cache.get(challenge_markup_variant)
+        if compressed_challenge_markup is None:
+            challenge_markup = self.get_challenge_markup(
+                was_previous_solution_incorrect,
+                use_ssl,
+                load_asynchronously,
+                )
+            compressor = _CHALLENGE_MARKUP_COMPRESSORS[content_coding]()
+            compressed_challenge_markup = \
+                compressor.compress(challenge_markup) + compressor.flush()
+            self._challenge_markup_cache[challenge_markup_variant] = \
+                compressed_challenge_markup
+        return compressed_challenge_markup
+
+    def get_challenge_loader_markup(
+        self,
+        was_previous_solution_incorrect=False,
+        use_ssl=False,
+        ):
+        """
+        Return the X/HTML code to load challenges into the placeholders on a
+        page.
+
         :type was_previous_solution_incorrect: :class:`bool`
         :param use_ssl: Whether to generate the markup with HTTPS URLs instead
             of HTTP ones
         :type use_ssl: :class:`bool`
         :rtype: :class:`str`
 
+        This markup must be included once on pages with several forms that
+        need a challenge, with one placeholder per form (see
+        :meth:`get_challenge_placeholder_markup`). The reCAPTCHA JavaScript API
+        is only loaded when the user focuses a field in one of those forms, and
+        the challenge is then displayed in that form's placeholder.
+
+        Only one challenge can be displayed on the page at any time, so it is
+        moved to another placeholder when the user switches forms.
+
         This method does not communicate with the remote reCAPTCHA API.
 
         """
-        challenge_markup_variables = {
-            'recaptcha_options_json': self.recaptcha_options_json,
+        challenge_markup_variant = \
+            ('loader', was_previous_solution_incorrect, use_ssl)
+        challenge_loader_markup = \
+            self._challenge_markup_cache.get(challenge_markup_variant)
+        if challenge_loader_markup is None:
+            challenge_loader_markup_variables = {
+                'recaptcha_options_json': self.recaptcha_options_json,
+                'placeholder_class_name':
+                    _RECAPTCHA_CHALLENGE_PLACEHOLDER_CLASS_NAME,
+                }
+            challenge_loader_markup_variables.update(
+                self._get_asynchronous_challenge_markup_variables(
+                    was_previous_solution_incorrect,
+                    use_ssl,
+                    ),
+                )
+            challenge_loader_markup = \
+                _RECAPTCHA_CHALLENGE_LOADER_MARKUP_TEMPLATE.format(
+                    **challenge_loader_markup_variables
+                    )
+            self._challenge_markup_cache[challenge_markup_variant] = \
+                challenge_loader_markup
+        return challenge_loader_markup
+
+    def get_challenge_placeholder_markup(
+        self,
+        widget_element_id,
+        was_previous_solution_incorrect=False,
+        use_ssl=False,
+        ):
+        """
+        Return the X/HTML code for a placeholder where a challenge will be
+        displayed.
+
+        :param widget_element_id: The HTML identifier of the placeholder,
+            unique within the page
+        :type widget_element_id: :class:`str`
+        :type was_previous_solution_incorrect: :class:`bool`
+        :param use_ssl: Whether to generate the markup with HTTPS URLs instead
+            of HTTP ones
+        :type use_ssl: :class:`bool`
+        :rtype: :class:`str`
+
+        The placeholder must be inside the ``form`` element whose submission
+        requires the challenge to be solved, and the page must include the
+        markup returned by :meth:`get_challenge_loader_markup` once.
+
+        This method does not communicate with the remote reCAPTCHA API.
+
+        """
+        challenge_placeholder_markup_variables = {
+            'widget_element_id': html_escape(widget_element_id, quote=True),
+            'placeholder_class_name':
+                _RECAPTCHA_CHALLENGE_PLACEHOLDER_CLASS_NAME,
             }
 
         challenge_urls = self._get_challenge_urls(
             was_previous_solution_incorrect,
             use_ssl,
             )
-        challenge_markup_variables.update(challenge_urls)
+        challenge_placeholder_markup_variables.update(challenge_urls)
 
-        challenge_markup = _RECAPTCHA_CHALLENGE_MARKUP_TEMPLATE.format(
-            **challenge_markup_variables
-            )
-        return challenge_markup
+        challenge_placeholder_markup = \
+            _RECAPTCHA_CHALLENGE_PLACEHOLDER_MARKUP_TEMPLATE.format(
+                **challenge_placeholder_markup_variables
+                )
+        return challenge_placeholder_markup
 
     def is_solution_correct(self, solution_text, challenge_id, remote_ip):
         """
@@ -179,27 +573,231 @@ class RecaptchaClient(object):
         ``verification_timeout`` set in the constructor.
 
         """
-        if not solution_text or not challenge_id:
-            return False
+        verification_result = \
+            self.verify(solution_text, challenge_id, remote_ip)
+        return verification_result.is_solution_correct
 
-        solution_text_decoded = \
-            solution_text.decode(RECAPTCHA_CHARACTER_ENCODING)
-        verification_result = self._get_recaptcha_response_for_solution(
-            solution_text_decoded,
-            challenge_id,
+    def verify(self, solution_text, challenge_id, remote_ip):
+        """
+        Verify the ``solution_text`` for ``challenge_id``.
+
+        :rtype: :class:`VerificationResult`
+
+        This method takes the same arguments and raises the same exceptions as
+        :meth:`is_solution_correct`, but the outcome is reported along with the
+        error code returned by reCAPTCHA and some metadata about the
+        communication with the API.
+
+        """
+        if not solution_text or not challenge_id:
+            verification_result = _EMPTY_SOLUTION_VERIFICATION_RESULT
+        else:
+            solution_text_decoded = \
+                solution_text.decode(RECAPTCHA_CHARACTER_ENCODING)
+            try:
+                verification_result = \
+                    self._get_recaptcha_response_for_solution(
+                        solution_text_decoded,
+                        challenge_id,
+                        remote_ip,
+                        )
+            except RecaptchaUnreachableError:
+                self._audit_verification(
+                    remote_ip,
+                    False,
+                    'recaptcha-not-reachable',
+                    )
+                raise
+
+        self._audit_verification(
             remote_ip,
+            verification_result.is_solution_correct,
+            verification_result.error_code,
             )
 
-        is_solution_correct = verification_result['is_solution_correct']
-
-        if not is_solution_correct:
-            error_code = verification_result['error_code']
+        if not verification_result.is_solution_correct:
+            error_code = verification_result.error_code
             if error_code == 'invalid-request-cookie':
                 raise RecaptchaInvalidChallengeError(challenge_id)
             elif error_code == 'invalid-site-private-key':
                 raise RecaptchaInvalidPrivateKeyError(self.private_key)
 
-        return is_solution_correct
+        return verification_result
+
+    def verify_many(
+        self,
+        verification_arguments,
+        max_parallelism=_DEFAULT_VERIFICATION_PARALLELISM,
+        ):
+        """
+        Verify several solutions concurrently.
+
+        :param verification_arguments: The arguments to :meth:`verify` for
+            each solution, as ``(solution_text, challenge_id, remote_ip)``
+        :type verification_arguments: iterable of :class:`tuple`
+        :param max_parallelism: Maximum number of solutions to verify at the
+            same time
+        :type max_parallelism: :class:`int`
+        :return: The :class:`VerificationResult` for each solution, or the
+            exception raised while verifying it, in the order of
+            ``verification_arguments``
+        :rtype: :class:`list`
+        :raises ValueError: If ``max_parallelism`` is lower than 1
+
+        """
+        verification_arguments = list(verification_arguments)
+        verification_outcomes = [None] * len(verification_arguments)
+        for index, verification_outcome in self.iter_verify_many(
+            verification_arguments,
+            max_parallelism,
+            ):
+            verification_outcomes[index] = verification_outcome
+        return verification_outcomes
+
+    def iter_verify_many(
+        self,
+        verification_arguments,
+        max_parallelism=_DEFAULT_VERIFICATION_PARALLELISM,
+        ):
+        """
+        Verify several solutions concurrently, yielding the outcome of each
+        verification as soon as it's available.
+
+        :return: An iterator of ``(index, outcome)`` tuples, where ``index`` is
+            the position of the solution in ``verification_arguments`` and
+            ``outcome`` is its :class:`VerificationResult` or the exception
+            raised while verifying it
+
+        This method takes the same arguments and raises the same exceptions as
+        :meth:`verify_many`.
+
+        """
+        if max_parallelism < 1:
+            raise ValueError(
+                'The maximum parallelism must be at least 1, not {0!r}'.format(
+                    max_parallelism,
+                    ),
+                )
+
+        return self._iter_verify_many(verification_arguments, max_parallelism)
+
+    def _iter_verify_many(self, verification_arguments, max_parallelism):
+        pending_verifications = Queue()
+        verification_count = 0
+        for verification in enumerate(verification_arguments):
+            pending_verifications.put(verification)
+            verification_count += 1
+
+        completed_verifications = Queue()
+        worker_count = min(max_parallelism, verification_count)
+        for _ in xrange(worker_count):
+            worker_thread = Thread(
+                target=self._verify_pending_solutions,
+                args=(pending_verifications, completed_verifications),
+                name='RecaptchaClient verifier',
+                )
+            worker_thread.daemon = True
+            worker_thread.start()
+
+        for _ in xrange(verification_count):
+            yield completed_verifications.get()
+
+    def _verify_pending_solutions(
+        self,
+        pending_verifications,
+        completed_verifications,
+        ):
+        while True:
+            try:
+                index, verification_arguments = \
+                    pending_verifications.get_nowait()
+            except Empty:
+                break
+
+            try:
+                verification_outcome = self.verify(*verification_arguments)
+            except Exception, exc:
+                verification_outcome = exc
+            completed_verifications.put((index, verification_outcome))
+
+    def _audit_verification(self, remote_ip, is_solution_correct, error_code):
+        if self.audit_log is not None:
+            self.audit_log.record(
+                time(),
+                remote_ip,
+                is_solution_correct,
+                error_code,
+                )
+
+    def _get_uncached_challenge_markup(
+        self,
+        was_previous_solution_incorrect,
+        use_ssl,
+        load_asynchronously,
+        ):
+        challenge_markup_variables = {
+            'recaptcha_options_json': self.recaptcha_options_json,
+            }
+
+        challenge_urls = self._get_challenge_urls(
+            was_previous_solution_incorrect,
+            use_ssl,
+            )
+        challenge_markup_variables.update(challenge_urls)
+
+        if load_asynchronously:
+            challenge_markup_variables.update(
+                self._get_asynchronous_challenge_markup_variables(
+                    was_previous_solution_incorrect,
+                    use_ssl,
+                    ),
+                )
+            challenge_markup_template = \
+                _RECAPTCHA_ASYNCHRONOUS_CHALLENGE_MARKUP_TEMPLATE
+        else:
+            challenge_markup_template = _RECAPTCHA_CHALLENGE_MARKUP_TEMPLATE
+
+        challenge_markup = challenge_markup_template.format(
+            **challenge_markup_variables
+            )
+        return challenge_markup
+
+    def _get_asynchronous_challenge_markup_variables(
+        self,
+        was_previous_solution_incorrect,
+        use_ssl,
+        ):
+        javascript_api_url = _get_recaptcha_api_call_url(
+            use_ssl,
+            _RECAPTCHA_JAVASCRIPT_API_RELATIVE_URL_PATH,
+            api_url=self.api_urls[0],
+            )
+
+        # The AJAX API ignores the query string of the script URL, so the error
+        # has to be passed on to the challenge via the options
+        if was_previous_solution_incorrect:
+            extra_options_javascript = \
+                'RecaptchaOptions.extra_challenge_params={0};'.format(
+                    json_encode('error=incorrect-captcha-sol'),
+                    )
+        else:
+            extra_options_javascript = ''
+
+        onload_javascript = 'Recaptcha.create({0},{1},RecaptchaOptions)'.format(
+            json_encode(self.public_key),
+            json_encode(_RECAPTCHA_WIDGET_ELEMENT_ID),
+            )
+
+        asynchronous_challenge_markup_variables = {
+            'recaptcha_options_json': self._minified_recaptcha_options_json,
+            'widget_element_id': _RECAPTCHA_WIDGET_ELEMENT_ID,
+            'extra_options_javascript': extra_options_javascript,
+            'public_key_json': json_encode(self.public_key),
+            'javascript_api_url': javascript_api_url,
+            'javascript_api_url_json': json_encode(javascript_api_url),
+            'onload_javascript': html_escape(onload_javascript, quote=True),
+            }
+        return asynchronous_challenge_markup_variables
 
     def _get_challenge_urls(
         self,
@@ -215,12 +813,14 @@ class RecaptchaClient(object):
             use_ssl,
             _RECAPTCHA_JAVASCRIPT_CHALLENGE_RELATIVE_URL_PATH,
             url_query_encoded,
+            self.api_urls[0],
             )
 
         noscript_challenge_url = _get_recaptcha_api_call_url(
             use_ssl,
             _RECAPTCHA_NOSCRIPT_CHALLENGE_RELATIVE_URL_PATH,
             url_query_encoded,
+            self.api_urls[0],
             )
 
         challenge_urls = {
@@ -235,39 +835,1279 @@ class RecaptchaClient(object):
         challenge_id,
         remote_ip,
         ):
-        verification_url = _get_recaptcha_api_call_url(
-            use_ssl=True,
+        start_time = time()
+        if self.verification_timeout is None:
+            deadline = None
+        else:
+            deadline = start_time + self.verification_timeout
+
+        api_endpoints = sorted(
+            self._api_endpoints,
+            key=lambda api_endpoint: api_endpoint.get_cost(start_time),
+            )
+        attempt_count = 0
+        unreachability_reason = \
+            'Verification timeout exceeded before contacting reCAPTCHA'
+        for api_endpoint_index, api_endpoint in enumerate(api_endpoints):
+            attempt_start_time = time()
+            if deadline is None:
+                timeout = None
+            elif attempt_start_time < deadline:
+                # An API which doesn't respond mustn't prevent the failover
+                remaining_time = deadline - attempt_start_time
+                remaining_api_endpoint_count = \
+                    len(api_endpoints) - api_endpoint_index
+                timeout = max(
+                    remaining_time / remaining_api_endpoint_count,
+                    min(remaining_time, _MINIMUM_API_ATTEMPT_TIMEOUT),
+                    )
+            else:
+                break
+
+            verification_protocol = \
+                self._verification_protocols_by_api_url[api_endpoint.api_url]
+            verification_request = verification_protocol.make_request(
+                solution_text_decoded,
+                challenge_id,
+                remote_ip,
+                )
+
+            attempt_count += 1
+            try:
+                verification_response = self._request_recaptcha_response(
+                    api_endpoint.verification_url,
+                    verification_request,
+                    timeout,
+                    )
+            except (RecaptchaInvalidResponseError, SocketError), exc:
+                api_endpoint.record_failure(time())
+                unreachability_reason = exc
+                continue
+
+            attempt_end_time = time()
+            verification_outcome, was_connection_reused, was_request_hedged = \
+                verification_response
+            is_solution_correct, error_code = verification_outcome
+
+            # reCAPTCHA reports its own connectivity problems as an error code,
+            # in which case another API may still be able to verify the solution
+            if error_code == 'recaptcha-not-reachable':
+                api_endpoint.record_failure(attempt_end_time)
+                if api_endpoint is not api_endpoints[-1]:
+                    unreachability_reason = error_code
+                    continue
+            else:
+                api_endpoint.record_success(
+                    attempt_end_time,
+                    attempt_end_time - attempt_start_time,
+                    )
+
+            verification_result = VerificationResult(
+                is_solution_correct,
+                error_code,
+                attempt_end_time - start_time,
+                attempt_count,
+                was_connection_reused,
+                was_request_hedged,
+                )
+            return verification_result
+
+        raise RecaptchaUnreachableError(unreachability_reason)
+
+    def _request_recaptcha_response(
+        self,
+        verification_url,
+        verification_request,
+        timeout,
+        ):
+        if self.hedging_delay is None:
+            verification_outcome, was_connection_reused = \
+                self._get_recaptcha_response_from_api(
+                    verification_url,
+                    verification_request,
+                    timeout,
+                    )
+            return verification_outcome, was_connection_reused, False
+
+        start_time = time()
+        request_outcomes = Queue()
+        self._start_recaptcha_request(
+            request_outcomes,
+            verification_url,
+            verification_request,
+            timeout,
+            is_hedge=False,
+            )
+        pending_request_count = 1
+        self.hedging_statistics.record_request()
+
+        if timeout is None:
+            hedging_delay = self.hedging_delay
+        else:
+            hedging_delay = min(self.hedging_delay, timeout)
+        try:
+            first_request_outcome = request_outcomes.get(timeout=hedging_delay)
+        except Empty:
+            first_request_outcome = None
+
+        # The hedge must not outlive the deadline of the original request
+        if timeout is None:
+            hedge_timeout = None
+        else:
+            hedge_timeout = timeout - (time() - start_time)
+
+        was_request_hedged = first_request_outcome is None and \
+            (hedge_timeout is None or 0 < hedge_timeout) and \
+            self.hedging_statistics.record_hedge(self.hedging_ratio)
+        if was_request_hedged:
+            self._start_recaptcha_request(
+                request_outcomes,
+                verification_url,
+                verification_request,
+                hedge_timeout,
+                is_hedge=True,
+                )
+            pending_request_count += 1
+
+        deferred_rejection = None
+        while True:
+            if first_request_outcome is None:
+                # Each request is bounded by the socket timeout
+                request_outcome = request_outcomes.get()
+            else:
+                request_outcome = first_request_outcome
+                first_request_outcome = None
+            pending_request_count -= 1
+
+            is_hedge, exception, response = request_outcome
+            if exception is None:
+                verification_outcome, _ = response
+                is_solution_correct = verification_outcome[0]
+                # Challenges can only be verified once, so either request may
+                # have been rejected because the other one used the challenge
+                if not is_solution_correct:
+                    if pending_request_count:
+                        deferred_rejection = (is_hedge, response)
+                        continue
+                    if is_hedge and deferred_rejection is not None:
+                        is_hedge, response = deferred_rejection
+            elif pending_request_count:
+                continue
+            elif deferred_rejection is None:
+                raise exception
+            else:
+                is_hedge, response = deferred_rejection
+
+            if is_hedge:
+                self.hedging_statistics.record_hedge_win()
+            verification_outcome, was_connection_reused = response
+            return (
+                verification_outcome,
+                was_connection_reused,
+                was_request_hedged,
+                )
+
+    def _start_recaptcha_request(
+        self,
+        request_outcomes,
+        verification_url,
+        verification_request,
+        timeout,
+        is_hedge,
+        ):
+        request_thread = Thread(
+            target=self._make_recaptcha_request,
+            args=(
+                request_outcomes,
+                verification_url,
+                verification_request,
+                timeout,
+                is_hedge,
+                ),
+            name='RecaptchaClient request',
+            )
+        request_thread.daemon = True
+        request_thread.start()
+
+    def _make_recaptcha_request(
+        self,
+        request_outcomes,
+        verification_url,
+        verification_request,
+        timeout,
+        is_hedge,
+        ):
+        try:
+            response = self._get_recaptcha_response_from_api(
+                verification_url,
+                verification_request,
+                timeout,
+                )
+        except Exception, exc:
+            request_outcomes.put((is_hedge, exc, None))
+        else:
+            request_outcomes.put((is_hedge, None, response))
+
+    def _get_recaptcha_response_from_api(
+        self,
+        verification_url,
+        verification_request,
+        timeout,
+        ):
+        verification_url_components = urlsplit(verification_url)
+        connection_key = (
+            verification_url_components.scheme,
+            verification_url_components.netloc,
+            )
+        if timeout is None:
+            deadline = None
+        else:
+            deadline = time() + timeout
+
+        connection, was_connection_reused = \
+            self._connection_pool.acquire(connection_key, timeout)
+        try:
+            verification_outcome = \
+                _make_verification_request(connection, verification_request)
+        except _ClosedConnectionError:
+            connection.close()
+            if not was_connection_reused:
+                raise
+
+            # The server closed the idle connection in the meantime, so the
+            # request can be retried without verifying the solution twice
+            if deadline is not None:
+                timeout = deadline - time()
+                if timeout <= 0:
+                    raise SocketTimeout('Verification timeout exceeded')
+            connection, was_connection_reused = \
+                self._connection_pool.acquire(connection_key, timeout, True)
+            try:
+                verification_outcome = _make_verification_request(
+                    connection,
+                    verification_request,
+                    )
+            except (RecaptchaInvalidResponseError, SocketError):
+                connection.close()
+                raise
+        except (RecaptchaInvalidResponseError, SocketError):
+            connection.close()
+            raise
+
+        self._connection_pool.release(connection_key, connection)
+
+        return verification_outcome, was_connection_reused
+
+
+class _HTTPConnectionPool(object):
+    """
+    Thread-safe pool of persistent HTTP(S) connections, by scheme and host.
+
+    Connections are only reused by one request at a time, and the proxies set
+    in the environment (e.g., ``https_proxy``) are honored.
+
+    """
+
+    def __init__(
+        self,
+        max_idle_connections_per_host=_MAXIMUM_IDLE_CONNECTIONS_PER_HOST,
+        ):
+        super(_HTTPConnectionPool, self).__init__()
+
+        self.max_idle_connections_per_host = max_idle_connections_per_host
+
+        self._idle_connections_by_key = {}
+        self._lock = Lock()
+
+    def acquire(self, connection_key, timeout, force_new_connection=False):
+        """
+        Return a connection for ``connection_key`` and whether it was reused.
+
+        """
+        if timeout is None:
+            timeout = _GLOBAL_DEFAULT_TIMEOUT
+
+        connection = None
+        if not force_new_connection:
+            with self._lock:
+                idle_connections = \
+                    self._idle_connections_by_key.get(connection_key)
+                if idle_connections:
+                    connection = idle_connections.pop()
+
+        if connection is not None:
+            connection.timeout = timeout
+            socket_timeout = \
+                None if timeout is _GLOBAL_DEFAULT_TIMEOUT else timeout
+            try:
+                connection.sock.settimeout(socket_timeout)
+            except SocketError:
+                connection.close()
+                connection = None
+
+        if connection is None:
+            connection = _make_http_connection(connection_key, timeout)
+            was_connection_reused = False
+        else:
+            was_connection_reused = True
+
+        return connection, was_connection_reused
+
+    def release(self, connection_key, connection):
+        """
+        Make ``connection`` available to subsequent requests, unless the pool
+        is full or the connection was closed.
+
+        """
+        if connection.sock is None:
+            return
+
+        with self._lock:
+            idle_connections = \
+                self._idle_connections_by_key.setdefault(connection_key, [])
+            if len(idle_connections) < self.max_idle_connections_per_host:
+                idle_connections.append(connection)
+                connection = None
+
+        if connection is not None:
+            connection.close()
+
+    def close(self):
+        """Close all the idle connections."""
+        with self._lock:
+            idle_connections_by_key = self._idle_connections_by_key
+            self._idle_connections_by_key = {}
+
+        for idle_connections in idle_connections_by_key.values():
+            for connection in idle_connections:
+                connection.close()
+
+
+class _RecaptchaAPIEndpoint(object):
+    """
+    Health of a reCAPTCHA API, as observed by the verification requests made
+    to it.
+
+    The latency and the error rate are exponentially weighted moving averages,
+    and the error rate also decays over time so that an API which failed in
+    the past gets tried again eventually.
+
+    """
+
+    def __init__(self, api_url, use_ssl=True):
+        super(_RecaptchaAPIEndpoint, self).__init__()
+
+        self.api_url = api_url
+        self.verification_url = _get_recaptcha_api_call_url(
+            use_ssl=use_ssl,
             relative_url_path=_RECAPTCHA_VERIFICATION_RELATIVE_URL_PATH,
+            api_url=api_url,
+            )
+
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self._error_rate_update_time = 0.0
+
+        self._lock = Lock()
+
+    def get_cost(self, current_time):
+        """
+        Return the expected number of seconds to get a response from this API.
+
+        APIs that haven't been used yet have no cost, so they all get tried at
+        least once.
+
+        """
+        error_rate = self._get_decayed_error_rate(current_time)
+        cost = self.latency + error_rate * _API_ENDPOINT_ERROR_PENALTY
+        return cost
+
+    def record_success(self, current_time, latency):
+        with self._lock:
+            if self.latency:
+                self.latency += _API_ENDPOINT_LATENCY_SMOOTHING_FACTOR * \
+                    (latency - self.latency)
+            else:
+                self.latency = latency
+            self._update_error_rate(current_time, 0)
+
+    def record_failure(self, current_time):
+        with self._lock:
+            self._update_error_rate(current_time, 1)
+
+    def _update_error_rate(self, current_time, error_count):
+        error_rate = self._get_decayed_error_rate(current_time)
+        error_rate_change = _API_ENDPOINT_ERROR_RATE_SMOOTHING_FACTOR * \
+            (error_count - error_rate)
+        self.error_rate = error_rate + error_rate_change
+        self._error_rate_update_time = current_time
+
+    def _get_decayed_error_rate(self, current_time):
+        time_since_update = current_time - self._error_rate_update_time
+        decay_factor = \
+            0.5 ** (time_since_update / _API_ENDPOINT_ERROR_RATE_HALF_LIFE)
+        return self.error_rate * decay_factor
+
+
+class VerificationResult(object):
+    """
+    Immutable outcome of the verification of a solution.
+
+    .. attribute:: is_solution_correct
+
+        Whether the solution was correct.
+
+    .. attribute:: error_code
+
+        The error code returned by reCAPTCHA (e.g., ``incorrect-captcha-sol``),
+        or ``None`` if the solution was correct.
+
+    .. attribute:: elapsed_time
+
+        Number of seconds spent communicating with reCAPTCHA.
+
+    .. attribute:: attempt_count
+
+        Number of requests made to reCAPTCHA. This is ``0`` when the API was
+        not contacted because the solution or the challenge were empty.
+
+    .. attribute:: was_connection_reused
+
+        Whether the request was sent over a previously established connection.
+
+    .. attribute:: was_request_hedged
+
+        Whether a second request was sent because reCAPTCHA was slow to
+        respond to the first one.
+
+    """
+
+    __slots__ = (
+        'is_solution_correct',
+        'error_code',
+        'elapsed_time',
+        'attempt_count',
+        'was_connection_reused',
+        'was_request_hedged',
+        )
+
+    def __init__(
+        self,
+        is_solution_correct,
+        error_code,
+        elapsed_time,
+        attempt_count,
+        was_connection_reused,
+        was_request_hedged=False,
+        ):
+        set_attribute = super(VerificationResult, self).__setattr__
+        set_attribute('is_solution_correct', is_solution_correct)
+        set_attribute('error_code', error_code)
+        set_attribute('elapsed_time', elapsed_time)
+        set_attribute('attempt_count', attempt_count)
+        set_attribute('was_connection_reused', was_connection_reused)
+        set_attribute('was_request_hedged', was_request_hedged)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{0!r} is immutable'.format(self))
+
+    def __delattr__(self, name):
+        raise AttributeError('{0!r} is immutable'.format(self))
+
+    def __eq__(self, other):
+        if not isinstance(other, VerificationResult):
+            return NotImplemented
+        return self._get_attribute_values() == other._get_attribute_values()
+
+    def __ne__(self, other):
+        are_results_equal = self.__eq__(other)
+        if are_results_equal is NotImplemented:
+            return are_results_equal
+        return not are_results_equal
+
+    def __hash__(self):
+        return hash(self._get_attribute_values())
+
+    def __repr__(self):
+        attribute_reprs = ', '.join(
+            '{0}={1!r}'.format(attribute_name, attribute_value)
+            for attribute_name, attribute_value in
+            zip(self.__slots__, self._get_attribute_values())
             )
-        request_data = urlencode({
-            'privatekey': self.private_key,
-            'remoteip': remote_ip,
-            'challenge': challenge_id,
-            'response': solution_text_decoded,
-            })
-        request = Request(
-            url=verification_url,
-            data=request_data,
-            headers={'User-agent': _CLIENT_USER_AGENT},
+        return '{0}({1})'.format(self.__class__.__name__, attribute_reprs)
+
+    def _get_attribute_values(self):
+        attribute_values = tuple(
+            getattr(self, attribute_name) for attribute_name in self.__slots__
+            )
+        return attribute_values
+
+
+class HedgingStatistics(object):
+    """
+    Counters of the hedged requests made by a :class:`RecaptchaClient`.
+
+    .. attribute:: request_count
+
+        Number of requests made while hedging was enabled.
+
+    .. attribute:: hedged_request_count
+
+        Number of requests that were hedged.
+
+    .. attribute:: hedge_win_count
+
+        Number of hedged requests where the second request was answered first.
+
+    """
+
+    def __init__(self):
+        super(HedgingStatistics, self).__init__()
+
+        self.request_count = 0
+        self.hedged_request_count = 0
+        self.hedge_win_count = 0
+
+        # Token bucket which earns a fraction of a hedge with each request
+        self._hedge_budget = 0.0
+        self._budgeted_request_count = 0
+
+        self._lock = Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def record_hedge(self, hedging_ratio):
+        """
+        Record a hedged request, unless that would exceed ``hedging_ratio``.
+
+        :return: Whether the request can be hedged
+        :rtype: :class:`bool`
+
+        Each request makes ``hedging_ratio`` hedges available, but no more
+        than a few unused hedges are kept, so that a burst of slow responses
+        after a long period of fast ones doesn't get every request hedged.
+
+        """
+        with self._lock:
+            new_request_count = \
+                self.request_count - self._budgeted_request_count
+            self._budgeted_request_count = self.request_count
+            self._hedge_budget = min(
+                self._hedge_budget + hedging_ratio * new_request_count,
+                _MAXIMUM_HEDGE_BURST,
+                )
+
+            is_hedge_allowed = 1 <= self._hedge_budget
+            if is_hedge_allowed:
+                self._hedge_budget -= 1
+                self.hedged_request_count += 1
+        return is_hedge_allowed
+
+    def record_hedge_win(self):
+        with self._lock:
+            self.hedge_win_count += 1
+
+
+_EMPTY_SOLUTION_VERIFICATION_RESULT = VerificationResult(
+    False,
+    'incorrect-captcha-sol',
+    elapsed_time=0.0,
+    attempt_count=0,
+    was_connection_reused=False,
+    )
+
+
+#{ Verification protocol
+
+
+class RecaptchaVerificationProtocol(object):
+    """
+    Verification requests to reCAPTCHA, without any I/O.
+
+    This class only produces the bytes to send to reCAPTCHA, and
+    :class:`RecaptchaVerificationResponseParser` only consumes the bytes
+    received, so that solutions can be verified with any I/O framework (e.g.,
+    Twisted, gevent or a custom event loop) without blocking.
+
+    The request line, the headers and the private key part of the body are
+    computed once, so making a request only involves encoding the arguments.
+    Requests are made with HTTP/1.1 and can be sent over persistent
+    connections.
+
+    """
+
+    def __init__(self, private_key, api_url=_RECAPTCHA_API_URL):
+        """
+
+        :param private_key: The reCAPTCHA API private key
+        :type private_key: :class:`str`
+        :param api_url: Base URL of the reCAPTCHA API
+        :type api_url: :class:`str`
+
+        """
+        super(RecaptchaVerificationProtocol, self).__init__()
+
+        self.private_key = private_key
+        self.api_url = api_url
+
+        verification_url_components = urlsplit(
+            _get_recaptcha_api_call_url(
+                use_ssl=True,
+                relative_url_path=_RECAPTCHA_VERIFICATION_RELATIVE_URL_PATH,
+                api_url=api_url,
+                ),
             )
+        self._request_head_prefix = \
+            _VERIFICATION_REQUEST_HEAD_PREFIX_TEMPLATE.format(
+                url_path=verification_url_components.path,
+                host=verification_url_components.netloc,
+                user_agent=_CLIENT_USER_AGENT,
+                )
+        self._request_body_prefix = \
+            'privatekey=' + _encode_form_value(private_key) + '&remoteip='
+
+    def make_request(self, solution_text, challenge_id, remote_ip):
+        """
+        Return the HTTP request to verify ``solution_text`` for
+        ``challenge_id``.
+
+        :param solution_text: The solution to the CAPTCHA challenge
+        :type solution_text: :class:`unicode` or :class:`str` encoded in
+            :data:`RECAPTCHA_CHARACTER_ENCODING`
+        :param challenge_id: The identifier for the CAPTCHA challenge
+        :type challenge_id: :class:`str`
+        :param remote_ip: The IP address of the user who provided the solution
+        :type remote_ip: :class:`str`
+        :rtype: :class:`str`
+
+        The request must be sent over a connection to the host of
+        :attr:`api_url` (using TLS is recommended), and the response should be
+        parsed with a new :class:`RecaptchaVerificationResponseParser`.
+
+        """
+        request_body = ''.join((
+            self._request_body_prefix,
+            _encode_form_value(remote_ip),
+            '&challenge=',
+            _encode_form_value(challenge_id),
+            '&response=',
+            _encode_form_value(solution_text),
+            ))
+        request = ''.join((
+            self._request_head_prefix,
+            str(len(request_body)),
+            '\r\n\r\n',
+            request_body,
+            ))
+        return request
+
+
+class RecaptchaVerificationResponseParser(object):
+    """
+    Incremental parser for the HTTP response to a verification request, without
+    any I/O.
+
+    Feed the bytes received from reCAPTCHA to :meth:`feed` as they arrive,
+    and call :meth:`feed_eof` if the connection is closed before the response
+    is complete. The outcome of the verification is a tuple with whether the
+    solution is correct and the error code returned by reCAPTCHA (``None`` if
+    the solution is correct).
+
+    Responses whose body is delimited by their length, by chunks or by the end
+    of the connection are supported. Once the headers have been parsed,
+    :attr:`will_close` tells whether the connection must be closed after the
+    response or whether it can be reused for another request.
+
+    """
+
+    def __init__(self):
+        super(RecaptchaVerificationResponseParser, self).__init__()
+
+        self.will_close = False
+
+        self._buffer = ''
+        self._body_chunks = []
+        self._remaining_size = None
+        self._parse_next = self._parse_head
+        self._outcome = None
+
+    def feed(self, data):
+        """
+        Parse ``data`` received from reCAPTCHA.
+
+        :type data: :class:`str`
+        :return: The outcome of the verification if the response is complete,
+            or ``None`` if more data is needed
+        :rtype: :class:`tuple` or ``None``
+        :raises RecaptchaInvalidResponseError: If the response is malformed or
+            its HTTP status is not ``200``
+
+        """
+        if self._outcome is not None:
+            if data:
+                raise RecaptchaInvalidResponseError(
+                    'Unexpected data after the response',
+                    )
+            return self._outcome
+
+        self._buffer += data
+        while self._outcome is None and self._parse_next():
+            pass
+
+        return self._outcome
+
+    def feed_eof(self):
+        """
+        Signal that the connection to reCAPTCHA was closed.
+
+        :return: The outcome of the verification
+        :rtype: :class:`tuple`
+        :raises RecaptchaInvalidResponseError: If the response is incomplete
+            or malformed
+
+        """
+        if self._outcome is None:
+            if self._parse_next != self._parse_body_until_eof:
+                raise RecaptchaInvalidResponseError(
+                    'Connection closed before the response was complete',
+                    )
+            self._finish(self._buffer)
+
+        return self._outcome
+
+    def _parse_head(self):
+        head_end = self._buffer.find('\r\n\r\n')
+        if head_end < 0:
+            if _MAXIMUM_VERIFICATION_RESPONSE_HEAD_SIZE < len(self._buffer):
+                raise RecaptchaInvalidResponseError('Response head too long')
+            return False
+
+        head = self._buffer[:head_end]
+        self._buffer = self._buffer[head_end + 4:]
+
+        status_line, _, header_lines = head.partition('\r\n')
+        status_line_parts = status_line.split(' ', 2)
+        if len(status_line_parts) < 2 or \
+                not status_line_parts[0].startswith('HTTP/'):
+            raise RecaptchaInvalidResponseError(
+                'Malformed status line {0!r}'.format(status_line),
+                )
+        http_version, status_code = status_line_parts[:2]
+
+        headers = {}
+        for header_line in header_lines.split('\r\n') if header_lines else ():
+            header_name, separator, header_value = header_line.partition(':')
+            if not separator:
+                raise RecaptchaInvalidResponseError(
+                    'Malformed header {0!r}'.format(header_line),
+                    )
+            headers[header_name.strip().lower()] = header_value.strip()
+
+        connection_options = [
+            connection_option.strip().lower() for connection_option in
+            headers.get('connection', '').split(',')
+            ]
+        if http_version == 'HTTP/1.0':
+            self.will_close = 'keep-alive' not in connection_options
+        else:
+            self.will_close = 'close' in connection_options
+
+        if status_code != '200':
+            raise RecaptchaInvalidResponseError(
+                'Unexpected HTTP status {0}'.format(
+                    ' '.join(status_line_parts[1:]),
+                    ),
+                )
+
+        transfer_coding = headers.get('transfer-encoding', '').lower()
+        if transfer_coding.endswith('chunked'):
+            self._parse_next = self._parse_chunk_size
+        elif 'content-length' in headers:
+            try:
+                self._remaining_size = int(headers['content-length'])
+            except ValueError:
+                self._remaining_size = -1
+            if self._remaining_size < 0:
+                raise RecaptchaInvalidResponseError(
+                    'Invalid Content-Length {0!r}'.format(
+                        headers['content-length'],
+                        ),
+                    )
+            self._parse_next = self._parse_body_with_length
+        else:
+            self.will_close = True
+            self._parse_next = self._parse_body_until_eof
+
+        return True
 
-        urlopen_kwargs = {}
-        if self.verification_timeout is not None:
-            urlopen_kwargs['timeout'] = self.verification_timeout
+    def _parse_body_with_length(self):
+        if len(self._buffer) < self._remaining_size:
+            return False
+        if self._remaining_size < len(self._buffer):
+            raise RecaptchaInvalidResponseError(
+                'Unexpected data after the response',
+                )
+
+        self._finish(self._buffer)
+        return True
+
+    def _parse_body_until_eof(self):
+        return False
+
+    def _parse_chunk_size(self):
+        line_end = self._buffer.find('\r\n')
+        if line_end < 0:
+            if _MAXIMUM_VERIFICATION_RESPONSE_HEAD_SIZE < len(self._buffer):
+                raise RecaptchaInvalidResponseError('Chunk size too long')
+            return False
+
+        chunk_size_line = self._buffer[:line_end]
+        self._buffer = self._buffer[line_end + 2:]
+
+        # Chunk extensions are ignored
         try:
-            response = urlopen(request, **urlopen_kwargs)
-        except URLError, exc:
-            raise RecaptchaUnreachableError(exc)
+            chunk_size = int(chunk_size_line.split(';', 1)[0], 16)
+        except ValueError:
+            chunk_size = -1
+        if chunk_size < 0:
+            raise RecaptchaInvalidResponseError(
+                'Invalid chunk size {0!r}'.format(chunk_size_line),
+                )
+
+        if chunk_size:
+            self._remaining_size = chunk_size
+            self._parse_next = self._parse_chunk_data
+        else:
+            self._parse_next = self._parse_chunked_body_trailer
+        return True
+
+    def _parse_chunk_data(self):
+        chunk_end = self._remaining_size
+        if len(self._buffer) < chunk_end + 2:
+            return False
+        if self._buffer[chunk_end:chunk_end + 2] != '\r\n':
+            raise RecaptchaInvalidResponseError('Malformed chunk')
+
+        self._body_chunks.append(self._buffer[:chunk_end])
+        self._buffer = self._buffer[chunk_end + 2:]
+        self._parse_next = self._parse_chunk_size
+        return True
+
+    def _parse_chunked_body_trailer(self):
+        if self._buffer.startswith('\r\n'):
+            trailer_end = 2
         else:
-            response_lines = response.read().splitlines()
-            response.close()
+            trailer_end = self._buffer.find('\r\n\r\n')
+            if trailer_end < 0:
+                if _MAXIMUM_VERIFICATION_RESPONSE_HEAD_SIZE < \
+                        len(self._buffer):
+                    raise RecaptchaInvalidResponseError('Trailer too long')
+                return False
+            trailer_end += 4
+
+        if trailer_end < len(self._buffer):
+            raise RecaptchaInvalidResponseError(
+                'Unexpected data after the response',
+                )
+
+        self._finish(''.join(self._body_chunks))
+        return True
+
+    def _finish(self, response_body):
+        response_lines = response_body.splitlines()
+        if not response_lines or response_lines[0] not in ('true', 'false'):
+            raise RecaptchaInvalidResponseError(
+                'Malformed response body {0!r}'.format(response_body),
+                )
 
         is_solution_correct = response_lines[0] == 'true'
-        verification_result = {'is_solution_correct': is_solution_correct}
-        if not is_solution_correct:
-            verification_result['error_code'] = response_lines[1]
+        if is_solution_correct:
+            error_code = None
+        elif 1 < len(response_lines):
+            error_code = response_lines[1]
+        else:
+            raise RecaptchaInvalidResponseError(
+                'Missing error code in response body {0!r}'.format(
+                    response_body,
+                    ),
+                )
 
-        return verification_result
+        self._outcome = (is_solution_correct, error_code)
+        self._buffer = ''
+        self._body_chunks = []
+
+
+#{ Auditing
+
+
+class RecaptchaAuditLog(object):
+    """
+    Log of the outcome of verifications, written in the background.
+
+    Records are kept in a bounded buffer in memory until a background thread
+    appends them to the file at ``file_path`` in batches, so recording a
+    verification doesn't involve any I/O. Each record is written as a line with
+    the following tab-separated fields: The Unix time of the verification, the
+    IP address of the user, ``1`` if the solution was correct or ``0``
+    otherwise, and the error code (or ``-`` if there was none). Verifications
+    which failed because reCAPTCHA couldn't be reached are recorded with the
+    error code ``recaptcha-not-reachable``. Control and non-ASCII characters in
+    the IP address and the error code are escaped with backslashes.
+
+    When the file exceeds ``max_file_size`` bytes, it's renamed by appending
+    ``.1`` to its name (after renaming any previous ``.1`` to ``.2`` and so on)
+    and a new file is created. At most ``backup_count`` old files are kept,
+    and the file is never rotated if ``backup_count`` is ``0``.
+
+    """
+
+    def __init__(
+        self,
+        file_path,
+        capacity=10000,
+        flush_interval=1.0,
+        max_file_size=10 * 1024 * 1024,
+        backup_count=5,
+        drop_policy='drop-newest',
+        ):
+        """
+
+        :param file_path: Path to the file where the records will be written
+        :type file_path: :class:`str`
+        :param capacity: Maximum number of records waiting to be written
+        :type capacity: :class:`int`
+        :param flush_interval: Number of seconds between two consecutive
+            writes to the file
+        :type flush_interval: :class:`float`
+        :param max_file_size: Number of bytes after which the file is rotated
+        :type max_file_size: :class:`int`
+        :param backup_count: Number of rotated files to keep
+        :type backup_count: :class:`int`
+        :param drop_policy: What to do with a record when the buffer is full:
+            ``drop-newest`` discards the new record and ``drop-oldest``
+            discards the oldest record waiting to be written
+        :type drop_policy: :class:`str`
+        :raises ValueError: If ``drop_policy`` is not supported
+
+        Records dropped because the buffer was full or because they couldn't be
+        written to the file are counted in :attr:`dropped_record_count`, and
+        those written successfully are counted in
+        :attr:`written_record_count`.
+
+        """
+        super(RecaptchaAuditLog, self).__init__()
+
+        if drop_policy not in _AUDIT_LOG_DROP_POLICIES:
+            raise ValueError('Unknown drop policy {0!r}'.format(drop_policy))
+
+        self.file_path = file_path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.max_file_size = max_file_size
+        self.backup_count = backup_count
+        self.drop_policy = drop_policy
+
+        self.dropped_record_count = 0
+        self.written_record_count = 0
+
+        # Popping from a deque is atomic, so the writer never holds the lock
+        # that producers take to enforce the capacity and count the drops
+        self._records = deque()
+        self._records_lock = Lock()
+
+        self._file = open(file_path, 'ab')
+        self._file_size = self._file.tell()
+        self._file_lock = Lock()
+
+        self._closing_event = Event()
+        self._writer_thread = Thread(
+            target=self._write_records_periodically,
+            name='RecaptchaAuditLog writer',
+            )
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+    def record(self, timestamp, remote_ip, is_solution_correct, error_code):
+        """
+        Queue the outcome of a verification to be written to the log.
+
+        :param timestamp: The Unix time of the verification
+        :type timestamp: :class:`float`
+        :type remote_ip: :class:`str`
+        :type is_solution_correct: :class:`bool`
+        :type error_code: :class:`str` or ``None``
+
+        This method never waits for the log to be written.
+
+        """
+        record = (timestamp, remote_ip, is_solution_correct, error_code)
+
+        with self._records_lock:
+            if len(self._records) < self.capacity:
+                self._records.append(record)
+            elif self.drop_policy == 'drop-oldest':
+                try:
+                    self._records.popleft()
+                except IndexError:
+                    # The writer took the records in the meantime
+                    pass
+                else:
+                    self.dropped_record_count += 1
+                self._records.append(record)
+            else:
+                self.dropped_record_count += 1
+
+    def flush(self):
+        """Write the records waiting in the buffer to the log."""
+        with self._file_lock:
+            records = []
+            try:
+                while True:
+                    records.append(self._records.popleft())
+            except IndexError:
+                pass
+
+            if records:
+                self._write_records(records)
+
+    def close(self):
+        """Write the records waiting in the buffer and close the log."""
+        self._closing_event.set()
+        self._writer_thread.join()
+
+        self.flush()
+        self._file.close()
+
+    def _write_records_periodically(self):
+        while not self._closing_event.is_set():
+            self._closing_event.wait(self.flush_interval)
+            self.flush()
+
+    def _write_records(self, records):
+        try:
+            serialized_records = ''.join(
+                _AUDIT_LOG_RECORD_TEMPLATE.format(
+                    timestamp=timestamp,
+                    remote_ip=_escape_audit_log_field(remote_ip),
+                    outcome=is_solution_correct,
+                    error_code=_escape_audit_log_field(error_code or '-'),
+                    )
+                for timestamp, remote_ip, is_solution_correct, error_code in
+                records
+                )
+
+            if self._file.closed:
+                # The file couldn't be reopened when it was last rotated
+                self._file = open(self.file_path, 'ab')
+                self._file_size = self._file.tell()
+            self._file.write(serialized_records)
+            self._file.flush()
+        except (IOError, OSError, ValueError):
+            with self._records_lock:
+                self.dropped_record_count += len(records)
+            return
+
+        self.written_record_count += len(records)
+        self._file_size += len(serialized_records)
+
+        if self.backup_count and self.max_file_size <= self._file_size:
+            try:
+                self._rotate_file()
+            except (IOError, OSError):
+                # The rotation will be retried along with the next write
+                pass
+
+    def _rotate_file(self):
+        self._file.close()
+
+        for backup_number in range(self.backup_count - 1, 0, -1):
+            backup_file_path = '{0}.{1}'.format(self.file_path, backup_number)
+            if path.exists(backup_file_path):
+                rename(
+                    backup_file_path,
+                    '{0}.{1}'.format(self.file_path, backup_number + 1),
+                    )
+        rename(self.file_path, self.file_path + '.1')
+
+        self._file = open(self.file_path, 'wb')
+        self._file_size = 0
+
+
+#{ Risk assessment
+
+
+class RecaptchaChallengeGate(object):
+    """
+    Decide which users should be presented with a challenge, based on the
+    recent activity from their IP addresses.
+
+    The number of attempts and failures from each IP address are estimated
+    with count-min sketches, so the memory used is fixed regardless of the
+    number of IP addresses seen, and recording an event or checking an IP
+    address takes constant time. Estimates can only be too high (when IP
+    addresses collide in every row of the sketch), so a suspicious IP address
+    is never let through because of a collision.
+
+    Past events lose half of their weight every ``half_life`` seconds, so IP
+    addresses stop being challenged once their activity calms down. The
+    decayed counts are rounded to the nearest integer before they are compared
+    with the thresholds.
+
+    It's up to the application to decide what counts as an attempt (e.g., a
+    form submission) and as a failure (e.g., an incorrect solution or a failed
+    login).
+
+    """
+
+    def __init__(
+        self,
+        attempt_threshold=10,
+        failure_threshold=3,
+        half_life=3600,
+        width=4096,
+        depth=4,
+        ):
+        """
+
+        :param attempt_threshold: Number of recent attempts from an IP address
+            from which its users must be challenged
+        :type attempt_threshold: :class:`int`
+        :param failure_threshold: Number of recent failures from an IP address
+            from which its users must be challenged
+        :type failure_threshold: :class:`int`
+        :param half_life: Number of seconds after which past events count half
+        :type half_life: :class:`float`
+        :param width: Number of counters in each row of the sketches
+        :type width: :class:`int`
+        :param depth: Number of rows in the sketches
+        :type depth: :class:`int`
+
+        The memory used is ``2 * width * depth`` double-precision numbers.
+
+        """
+        super(RecaptchaChallengeGate, self).__init__()
+
+        self.attempt_threshold = attempt_threshold
+        self.failure_threshold = failure_threshold
+
+        self._attempt_sketch = _DecayingCountMinSketch(width, depth, half_life)
+        self._failure_sketch = _DecayingCountMinSketch(width, depth, half_life)
+
+    def record_attempt(self, remote_ip, is_failure=False):
+        """
+        Record an attempt from ``remote_ip``.
+
+        :type remote_ip: :class:`str`
+        :param is_failure: Whether the attempt also counts as a failure
+        :type is_failure: :class:`bool`
+
+        """
+        current_time = time()
+        self._attempt_sketch.add(remote_ip, current_time)
+        if is_failure:
+            self._failure_sketch.add(remote_ip, current_time)
+
+    def should_challenge(self, remote_ip):
+        """
+        Report whether users from ``remote_ip`` should solve a challenge.
+
+        :type remote_ip: :class:`str`
+        :rtype: :class:`bool`
+
+        """
+        current_time = time()
+        attempt_count = \
+            self._attempt_sketch.get_estimate(remote_ip, current_time)
+        if self.attempt_threshold <= round(attempt_count):
+            return True
+
+        failure_count = \
+            self._failure_sketch.get_estimate(remote_ip, current_time)
+        return self.failure_threshold <= round(failure_count)
+
+
+class _DecayingCountMinSketch(object):
+    """
+    Count-min sketch whose counts decay exponentially over time.
+
+    Decay is implemented with forward decay: Each event is added with a weight
+    that grows exponentially with the time elapsed since a landmark time, and
+    estimates are divided by the weight at the time of the query. This way,
+    counters don't need to be updated as time passes, except for a rescaling
+    every ``_SKETCH_MAXIMUM_WEIGHT_EXPONENT`` half-lives.
+
+    """
+
+    def __init__(self, width, depth, half_life):
+        super(_DecayingCountMinSketch, self).__init__()
+
+        self.width = width
+        self.depth = depth
+        self.half_life = half_life
+
+        self._rows = [array('d', [0.0]) * width for _ in range(depth)]
+        self._landmark_time = None
+
+        self._lock = Lock()
+
+    def add(self, key, current_time):
+        with self._lock:
+            if self._landmark_time is None:
+                self._landmark_time = current_time
+
+            elapsed_half_lives = self._get_elapsed_half_lives(current_time)
+            if _SKETCH_MAXIMUM_WEIGHT_EXPONENT <= elapsed_half_lives:
+                self._rescale(elapsed_half_lives, current_time)
+                weight = 1.0
+            else:
+                weight = 2 ** elapsed_half_lives
+
+            for row, column in zip(self._rows, self._get_columns(key)):
+                row[column] += weight
+
+    def get_estimate(self, key, current_time):
+        columns = self._get_columns(key)
+
+        # The counters and the landmark must be read as of the same rescaling
+        with self._lock:
+            if self._landmark_time is None:
+                return 0.0
+
+            elapsed_half_lives = self._get_elapsed_half_lives(current_time)
+            if _SKETCH_EXPIRY_EXPONENT <= elapsed_half_lives:
+                return 0.0
+
+            weighted_estimate = \
+                min(row[column] for row, column in zip(self._rows, columns))
+        return weighted_estimate / 2 ** elapsed_half_lives
+
+    def _get_elapsed_half_lives(self, current_time):
+        return (current_time - self._landmark_time) / float(self.half_life)
+
+    def _rescale(self, elapsed_half_lives, current_time):
+        if _SKETCH_EXPIRY_EXPONENT <= elapsed_half_lives:
+            for row in self._rows:
+                for column in xrange(self.width):
+                    row[column] = 0.0
+        else:
+            weight = 2 ** elapsed_half_lives
+            for row in self._rows:
+                for column in xrange(self.width):
+                    row[column] /= weight
+        self._landmark_time = current_time
+
+    def _get_columns(self, key):
+        # Double hashing: The columns for all the rows are derived from two
+        # hashes of the key
+        first_hash = hash(key)
+        second_hash = hash((key, self.width)) | 1
+        columns = [
+            (first_hash + row_index * second_hash) % self.width
+            for row_index in xrange(self.depth)
+            ]
+        return columns
 
 
 #{ Exceptions
@@ -290,13 +2130,97 @@ class RecaptchaUnreachableError(RecaptchaException):
     pass
 
 
+class RecaptchaInvalidResponseError(RecaptchaException):
+    pass
+
+
+class _ClosedConnectionError(SocketError):
+    """The connection was closed before any response was received."""
+    pass
+
+
 #{ Utilities
 
 
-def _get_recaptcha_api_call_url(use_ssl, relative_url_path, encoded_query=''):
+def _make_http_connection(connection_key, timeout):
+    url_scheme, host = connection_key
+    connection_class = \
+        HTTPSConnection if url_scheme == 'https' else HTTPConnection
+
+    proxy_url = getproxies().get(url_scheme)
+    if proxy_url and not proxy_bypass(host.split(':')[0]):
+        proxy_url_components = urlsplit(proxy_url)
+        connection = connection_class(
+            proxy_url_components.netloc,
+            timeout=timeout,
+            )
+        connection.set_tunnel(host)
+    else:
+        connection = connection_class(host, timeout=timeout)
+
+    return connection
+
+
+def _make_verification_request(connection, verification_request):
+    if connection.sock is None:
+        connection.connect()
+
+    # Failing to send the request or getting no response at all are the only
+    # signs that the server closed the connection before reading the request
+    try:
+        connection.sock.sendall(verification_request)
+        response_data = connection.sock.recv(_VERIFICATION_RESPONSE_READ_SIZE)
+    except SocketTimeout:
+        raise
+    except SocketError, exc:
+        if exc.errno not in _CLOSED_CONNECTION_ERRNOS:
+            raise
+        raise _ClosedConnectionError(exc.errno, exc.strerror)
+    if not response_data:
+        raise _ClosedConnectionError('Connection closed without a response')
+
+    response_parser = RecaptchaVerificationResponseParser()
+    verification_outcome = response_parser.feed(response_data)
+    while verification_outcome is None:
+        response_data = connection.sock.recv(_VERIFICATION_RESPONSE_READ_SIZE)
+        if response_data:
+            verification_outcome = response_parser.feed(response_data)
+        else:
+            verification_outcome = response_parser.feed_eof()
+
+    if response_parser.will_close:
+        connection.close()
+
+    return verification_outcome
+
+
+def _escape_audit_log_field(value):
+    # Tabs, line breaks and non-ASCII characters are escaped, so that a field
+    # can't break the log file or forge records
+    if isinstance(value, unicode):
+        escaped_value = value.encode('unicode_escape')
+    else:
+        escaped_value = str(value).encode('string_escape')
+    return escaped_value
+
+
+def _encode_form_value(value):
+    if isinstance(value, unicode):
+        value = value.encode(RECAPTCHA_CHARACTER_ENCODING)
+    else:
+        value = str(value)
+    return url_quote_plus(value)
+
+
+def _get_recaptcha_api_call_url(
+    use_ssl,
+    relative_url_path,
+    encoded_query='',
+    api_url=_RECAPTCHA_API_URL,
+    ):
     url_scheme = 'https' if use_ssl else 'http'
 
-    recaptcha_api_url_components = urlsplit(_RECAPTCHA_API_URL)
+    recaptcha_api_url_components = urlsplit(api_url)
     url_path = urljoin(
         recaptcha_api_url_components.path,
         relative_url_path,
@@ -312,4 +2236,167 @@ def _get_recaptcha_api_call_url(use_ssl, relative_url_path, encoded_query=''):
     return url
 
 
+#{ Command-line interface
+
+
+def _render_challenge_markup_files(
+    output_directory_path,
+    public_keys,
+    recaptcha_options_by_profile_name,
+    ):
+    manifest = {}
+    for public_key in public_keys:
+        public_key_directory_path = path.join(
+            output_directory_path,
+            _get_public_key_directory_name(public_key),
+            )
+        manifest[public_key] = public_key_manifest = {}
+        for profile_name, recaptcha_options in \
+                recaptcha_options_by_profile_name.items():
+            profile_directory_path = \
+                path.join(public_key_directory_path, profile_name)
+            if not path.isdir(profile_directory_path):
+                makedirs(profile_directory_path)
+
+            client = RecaptchaClient(None, public_key, recaptcha_options)
+            public_key_manifest[profile_name] = \
+                _write_challenge_markup_variants(client, profile_directory_path)
+
+    manifest_file_path = path.join(output_directory_path, 'manifest.json')
+    _write_file(manifest_file_path, json_encode(manifest, sort_keys=True))
+
+    return manifest
+
+
+def _get_public_key_directory_name(public_key):
+    return url_quote(public_key, safe='')
+
+
+def _is_plain_path_segment(name):
+    is_plain_path_segment = name not in ('', path.curdir, path.pardir) and \
+        path.sep not in name and \
+        (not path.altsep or path.altsep not in name)
+    return is_plain_path_segment
+
+
+def _write_challenge_markup_variants(client, directory_path):
+    file_names_by_variant_name = {}
+    for load_asynchronously in (False, True):
+        for use_ssl in (False, True):
+            for was_previous_solution_incorrect in (False, True):
+                variant_name = '-'.join((
+                    'https' if use_ssl else 'http',
+                    'incorrect' if was_previous_solution_incorrect else
+                    'initial',
+                    'async' if load_asynchronously else 'sync',
+                    ))
+                challenge_markup = client.get_challenge_markup(
+                    was_previous_solution_incorrect,
+                    use_ssl,
+                    load_asynchronously,
+                    )
+                challenge_markup_hash = sha1(challenge_markup).hexdigest()[:12]
+                file_name = '{0}.{1}.html'.format(
+                    variant_name,
+                    challenge_markup_hash,
+                    )
+                file_path = path.join(directory_path, file_name)
+                _write_file(file_path, challenge_markup)
+
+                compressed_challenge_markup = \
+                    client.get_compressed_challenge_markup(
+                        'gzip',
+                        was_previous_solution_incorrect,
+                        use_ssl,
+                        load_asynchronously,
+                        )
+                _write_file(file_path + '.gz', compressed_challenge_markup)
+
+                file_names_by_variant_name[variant_name] = file_name
+
+    return file_names_by_variant_name
+
+
+def _write_file(file_path, file_contents):
+    with open(file_path, 'wb') as file_:
+        file_.write(file_contents)
+
+
+def _main(arguments=None):
+    option_parser = OptionParser(
+        usage='%prog render [options]',
+        description=_CHALLENGE_MARKUP_RENDERING_COMMAND_DESCRIPTION,
+        prog='python -m recaptcha',
+        )
+    option_parser.add_option(
+        '-k',
+        '--public-key',
+        action='append',
+        dest='public_keys',
+        default=[],
+        metavar='KEY',
+        help='reCAPTCHA API public key (can be used more than once)',
+        )
+    option_parser.add_option(
+        '-p',
+        '--options-profile',
+        action='append',
+        dest='options_profiles',
+        default=[],
+        metavar='NAME=JSON',
+        help='Named set of reCAPTCHA options (can be used more than once)',
+        )
+    option_parser.add_option(
+        '-o',
+        '--output-directory',
+        dest='output_directory_path',
+        default='.',
+        metavar='DIRECTORY',
+        help='Directory where the markup will be written [default: %default]',
+        )
+    options, positional_arguments = option_parser.parse_args(arguments)
+
+    if positional_arguments != ['render']:
+        option_parser.error('The only command supported is "render"')
+    if not options.public_keys:
+        option_parser.error('At least one public key is required')
+    for public_key in options.public_keys:
+        public_key_directory_name = _get_public_key_directory_name(public_key)
+        if not _is_plain_path_segment(public_key_directory_name):
+            option_parser.error('Invalid public key {0!r}'.format(public_key))
+
+    recaptcha_options_by_profile_name = {}
+    for options_profile in options.options_profiles:
+        profile_name, separator, recaptcha_options_json = \
+            options_profile.partition('=')
+        if not separator or not _is_plain_path_segment(profile_name):
+            option_parser.error(
+                'Invalid options profile {0!r}'.format(options_profile),
+                )
+        try:
+            recaptcha_options = json_decode(recaptcha_options_json)
+        except ValueError, exc:
+            option_parser.error(
+                'Invalid options in profile {0!r}: {1}'.format(
+                    profile_name,
+                    exc,
+                    ),
+                )
+        recaptcha_options_by_profile_name[profile_name] = recaptcha_options
+    if not recaptcha_options_by_profile_name:
+        recaptcha_options_by_profile_name[
+            _DEFAULT_RECAPTCHA_OPTIONS_PROFILE_NAME
+            ] = None
+
+    _render_challenge_markup_files(
+        options.output_directory_path,
+        options.public_keys,
+        recaptcha_options_by_profile_name,
+        )
+
+
 #}
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,382 @@
+################################################################################
+#
+# Copyright (c) 2012, 2degrees Limited <2degrees-floss@googlegroups.com>.
+# All Rights Reserved.
+#
+# This file is part of python-recaptcha <http://packages.python.org/recaptcha>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+################################################################################
+"""
+Soak test for the reCAPTCHA client.
+
+It verifies solutions and generates challenges repeatedly against a local
+stand-in for the reCAPTCHA API which injects failures (dropped connections,
+HTTP errors, ``recaptcha-not-reachable`` responses and timeouts), and it fails
+if the resident memory, the open file descriptors or the number of live
+objects keep growing once the client has warmed up.
+
+Usage::
+
+    python soak.py --iterations 1000000
+
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from collections import defaultdict
+from optparse import OptionParser
+from os import listdir
+from os import sysconf
+from random import Random
+from socket import IPPROTO_TCP
+from socket import TCP_NODELAY
+from SocketServer import ThreadingMixIn
+from threading import Thread
+from time import sleep
+import gc
+import sys
+
+from recaptcha import RecaptchaClient
+from recaptcha import RecaptchaException
+
+
+_FAKE_PRIVATE_KEY = 'private key'
+_FAKE_PUBLIC_KEY = 'public key'
+
+
+_FAKE_CHALLENGE_ID = '12345'
+
+
+_VERIFICATION_TIMEOUT = 0.05
+
+
+_FAILURE_MODES = ('drop', 'server-error', 'not-reachable', 'timeout')
+
+
+_SAMPLE_TEMPLATE = \
+    '{iteration:>10} {rss_kb:>10} {file_descriptor_count:>5} ' \
+    '{object_count:>10} {unreachable_count:>8}'
+
+
+#{ Stand-in reCAPTCHA API
+
+
+class _SoakTestServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    allow_reuse_address = True
+
+    def __init__(self, failure_rate, random_seed):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _FakeRecaptchaHandler)
+
+        self.failure_rate = failure_rate
+        self.random = Random(random_seed)
+
+    def handle_error(self, request, client_address):
+        # Clients time out and drop connections on purpose
+        pass
+
+
+class _FakeRecaptchaHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+
+        # The headers and the body are sent separately, so Nagle's algorithm
+        # would delay the body until the client acknowledges the headers
+        self.connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+
+        random = self.server.random
+        if random.random() < self.server.failure_rate:
+            failure_mode = random.choice(_FAILURE_MODES)
+        else:
+            failure_mode = None
+
+        if failure_mode == 'drop':
+            self.close_connection = 1
+            return
+
+        if failure_mode == 'timeout':
+            sleep(_VERIFICATION_TIMEOUT * 2)
+
+        if failure_mode == 'server-error':
+            response_status = 500
+            response_body = 'Internal server error'
+        elif failure_mode == 'not-reachable':
+            response_status = 200
+            response_body = 'false\nrecaptcha-not-reachable'
+        elif random.random() < 0.5:
+            response_status = 200
+            response_body = 'true\nsuccess'
+        else:
+            response_status = 200
+            response_body = 'false\nincorrect-captcha-sol'
+
+        self.send_response(response_status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def log_message(self, *args):
+        pass
+
+
+#{ Resource usage
+
+
+def _get_rss_kb():
+    # The peak reported by getrusage() can't reveal growth after the warm-up,
+    # so the current usage is only available where /proc is
+    try:
+        with open('/proc/self/statm') as statm_file:
+            resident_page_count = int(statm_file.read().split()[1])
+    except IOError:
+        return None
+    return resident_page_count * sysconf('SC_PAGE_SIZE') // 1024
+
+
+def _get_file_descriptor_count():
+    for file_descriptors_directory_path in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(listdir(file_descriptors_directory_path))
+        except OSError:
+            pass
+    return None
+
+
+def _get_object_counts_by_type():
+    gc.collect()
+    object_counts_by_type = defaultdict(int)
+    for object_ in gc.get_objects():
+        object_counts_by_type[type(object_).__name__] += 1
+    return object_counts_by_type
+
+
+def _get_object_count_growths(
+    initial_object_counts_by_type,
+    final_object_counts_by_type,
+    ):
+    object_count_growths = []
+    for type_name, final_object_count in final_object_counts_by_type.items():
+        object_count_growth = \
+            final_object_count - initial_object_counts_by_type.get(type_name, 0)
+        if 0 < object_count_growth:
+            object_count_growths.append((object_count_growth, type_name))
+    object_count_growths.sort(reverse=True)
+    return object_count_growths
+
+
+#{ Soak test
+
+
+def _run_soak_test(options):
+    server = _SoakTestServer(options.failure_rate, options.random_seed)
+    server_thread = Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    api_url = 'http://127.0.0.1:{0}/recaptcha/api/'.format(server.server_port)
+    client = RecaptchaClient(
+        _FAKE_PRIVATE_KEY,
+        _FAKE_PUBLIC_KEY,
+        verification_timeout=_VERIFICATION_TIMEOUT,
+        api_urls=[api_url],
+        # The stand-in API doesn't support TLS
+        verify_over_ssl=False,
+        )
+
+    warm_up_iteration_count = options.iterations // 10
+    sample_interval = max(options.iterations // options.samples, 1)
+
+    print _SAMPLE_TEMPLATE.replace(':>', ':^').format(
+        iteration='iteration',
+        rss_kb='rss_kb',
+        file_descriptor_count='fds',
+        object_count='objects',
+        unreachable_count='errors',
+        )
+
+    unreachable_count = 0
+    initial_sample = None
+    for iteration in xrange(1, options.iterations + 1):
+        was_previous_solution_incorrect = bool(iteration % 2)
+        use_ssl = bool(iteration % 3)
+        client.get_challenge_markup(was_previous_solution_incorrect, use_ssl)
+
+        try:
+            client.is_solution_correct(
+                'hello world',
+                _FAKE_CHALLENGE_ID,
+                '192.0.2.0',
+                )
+        except RecaptchaException:
+            unreachable_count += 1
+
+        if iteration == warm_up_iteration_count or \
+                iteration % sample_interval == 0 or \
+                iteration == options.iterations:
+            object_counts_by_type = _get_object_counts_by_type()
+            sample = {
+                'iteration': iteration,
+                'rss_kb': _get_rss_kb(),
+                'file_descriptor_count': _get_file_descriptor_count(),
+                'object_counts_by_type': object_counts_by_type,
+                'object_count': sum(object_counts_by_type.values()),
+                'unreachable_count': unreachable_count,
+                }
+            print _SAMPLE_TEMPLATE.format(
+                iteration=iteration,
+                rss_kb=_format_metric(sample['rss_kb']),
+                file_descriptor_count=
+                    _format_metric(sample['file_descriptor_count']),
+                object_count=sample['object_count'],
+                unreachable_count=unreachable_count,
+                )
+            sys.stdout.flush()
+
+            if iteration == warm_up_iteration_count:
+                initial_sample = sample
+
+    final_sample = sample
+
+    client._connection_pool.close()
+    server.shutdown()
+    server.server_close()
+
+    return _check_resource_growth(options, initial_sample, final_sample)
+
+
+def _format_metric(metric_value):
+    return 'n/a' if metric_value is None else metric_value
+
+
+def _check_resource_growth(options, initial_sample, final_sample):
+    problems = []
+
+    if final_sample['rss_kb'] is None:
+        print >> sys.stderr, \
+            'Resident memory is not available on this platform; not checked'
+    else:
+        rss_growth = final_sample['rss_kb'] - initial_sample['rss_kb']
+        if options.max_rss_growth < rss_growth:
+            problems.append(
+                'Resident memory grew by {0} KiB'.format(rss_growth),
+                )
+
+    if final_sample['file_descriptor_count'] is None:
+        print >> sys.stderr, 'Open file descriptors are not available on ' \
+            'this platform; not checked'
+    else:
+        file_descriptor_count_growth = \
+            final_sample['file_descriptor_count'] - \
+            initial_sample['file_descriptor_count']
+        if options.max_file_descriptor_growth < file_descriptor_count_growth:
+            problems.append(
+                '{0} more file descriptors are open'.format(
+                    file_descriptor_count_growth,
+                    ),
+                )
+
+    object_count_growths = _get_object_count_growths(
+        initial_sample['object_counts_by_type'],
+        final_sample['object_counts_by_type'],
+        )
+    object_count_growth = \
+        final_sample['object_count'] - initial_sample['object_count']
+    if options.max_object_growth < object_count_growth:
+        problems.append(
+            '{0} more objects are alive. Top growth by type: {1}'.format(
+                object_count_growth,
+                ', '.join(
+                    '{0} (+{1})'.format(type_name, type_object_count_growth)
+                    for type_object_count_growth, type_name in
+                    object_count_growths[:5]
+                    ),
+                ),
+            )
+
+    for problem in problems:
+        print >> sys.stderr, problem
+
+    return 1 if problems else 0
+
+
+def _main(arguments=None):
+    option_parser = OptionParser(usage='%prog [options]', description=__doc__)
+    option_parser.add_option(
+        '-n',
+        '--iterations',
+        type='int',
+        default=1000000,
+        help='Number of verifications [default: %default]',
+        )
+    option_parser.add_option(
+        '--samples',
+        type='int',
+        default=50,
+        help='Number of resource usage samples [default: %default]',
+        )
+    option_parser.add_option(
+        '--failure-rate',
+        type='float',
+        default=0.05,
+        help='Proportion of failed API requests [default: %default]',
+        )
+    option_parser.add_option(
+        '--random-seed',
+        type='int',
+        default=0,
+        help='Seed for the injection of failures [default: %default]',
+        )
+    option_parser.add_option(
+        '--max-rss-growth',
+        type='int',
+        default=4096,
+        metavar='KIB',
+        help='Tolerated growth of the resident memory after the warm-up '
+            '[default: %default]',
+        )
+    option_parser.add_option(
+        '--max-file-descriptor-growth',
+        type='int',
+        default=4,
+        metavar='COUNT',
+        help='Tolerated growth of the open file descriptors after the warm-up '
+            '[default: %default]',
+        )
+    option_parser.add_option(
+        '--max-object-growth',
+        type='int',
+        default=1000,
+        metavar='COUNT',
+        help='Tolerated growth of the live objects after the warm-up '
+            '[default: %default]',
+        )
+    options, positional_arguments = option_parser.parse_args(arguments)
+
+    if positional_arguments:
+        option_parser.error('No positional arguments are supported')
+    if options.iterations < 10:
+        option_parser.error('At least 10 iterations are required')
+
+    return _run_soak_test(options)
+
+
+#}
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
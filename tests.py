@@ -15,11 +15,25 @@
 ################################################################################
 
 from json import loads as json_decode
+from os import mkdir
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from socket import error as SocketError
+from socket import timeout as SocketTimeout
+from threading import Lock
+from threading import Thread
+from time import sleep
+from time import time
 from urlparse import parse_qs
 from urlparse import urlparse
+import zlib
 
 from nose.tools import assert_false
 from nose.tools import assert_in
+from nose.tools import assert_is_instance
 from nose.tools import assert_not_equal
 from nose.tools import assert_not_in
 from nose.tools import assert_raises
@@ -27,33 +41,68 @@ from nose.tools import assert_raises_regexp
 from nose.tools import eq_
 from nose.tools import ok_
 
+from recaptcha import _CLIENT_USER_AGENT
+from recaptcha import _DecayingCountMinSketch
+from recaptcha import _HTTPConnectionPool
+from recaptcha import _main
 from recaptcha import _RECAPTCHA_API_URL
+from recaptcha import _RecaptchaAPIEndpoint
+from recaptcha import HedgingStatistics
+from recaptcha import RecaptchaAuditLog
+from recaptcha import RecaptchaChallengeGate
 from recaptcha import RecaptchaClient
 from recaptcha import RecaptchaInvalidChallengeError
 from recaptcha import RecaptchaInvalidPrivateKeyError
+from recaptcha import RecaptchaInvalidResponseError
+from recaptcha import RecaptchaUnreachableError
+from recaptcha import RecaptchaVerificationProtocol
+from recaptcha import RecaptchaVerificationResponseParser
+from recaptcha import VerificationResult
 
 
 __all__ = [
+    'TestAPIEndpointHealth',
+    'TestAPIFailover',
+    'TestAsynchronousChallengeMarkup',
+    'TestAuditLog',
+    'TestChallengeMarkupCompression',
+    'TestChallengeGate',
+    'TestChallengeLoaderMarkup',
+    'TestChallengeMarkupRendering',
     'TestChallengeOptions',
     'TestChallengeURLsGeneration',
+    'TestConnectionPooling',
+    'TestDecayingCountMinSketch',
+    'TestHedging',
     'TestSolutionEncoding',
     'TestSolutionVerification',
+    'TestVerificationProtocol',
+    'TestVerificationResponseParser',
+    'TestVerificationResult',
+    'TestVerifyMany',
     ]
 
 
-_CORRECT_SOLUTION_RESULT = {'is_solution_correct': True}
+_CORRECT_SOLUTION_RESULT = VerificationResult(True, None, 0.1, 1, False)
 
 
-_INCORRECT_SOLUTION_RESULT = {
-    'is_solution_correct': False,
-    'error_code': 'incorrect-captcha-sol',
-    }
+_INCORRECT_SOLUTION_RESULT = VerificationResult(
+    False,
+    'incorrect-captcha-sol',
+    0.1,
+    1,
+    False,
+    )
 
 
 _FAKE_PRIVATE_KEY = 'private key'
 _FAKE_PUBLIC_KEY = 'public key'
 
 
+_PRIMARY_API_URL = 'http://primary.example.com/recaptcha/api/'
+_SECONDARY_API_URL = 'http://secondary.example.com/recaptcha/api/'
+
+
 _FAKE_SOLUTION_TEXT = 'hello world'
 _FAKE_CHALLENGE_ID = '12345'
 _RANDOM_REMOTE_IP = '192.0.2.0'
@@ -185,6 +234,288 @@ class TestChallengeOptions(object):
         assert_false(decoded_recaptcha_options)
 
 
+class TestAsynchronousChallengeMarkup(object):
+
+    def setup(self):
+        self.client = _OfflineVerificationClient()
+
+    def test_minification(self):
+        client = RecaptchaClient(
+            _FAKE_PRIVATE_KEY,
+            _FAKE_PUBLIC_KEY,
+            {'theme': 'clean', 'lang': 'en'},
+            )
+
+        for challenge_markup in (
+            client.get_challenge_markup(load_asynchronously=True),
+            client.get_challenge_loader_markup(),
+            ):
+            assert_not_in('\n', challenge_markup)
+            assert_not_in('  ', challenge_markup)
+            assert_not_in('", "', challenge_markup)
+            assert_not_in('": "', challenge_markup)
+            assert_in('"theme":"clean"', challenge_markup)
+
+    def test_script_loading(self):
+        challenge_markup = \
+            self.client.get_challenge_markup(load_asynchronously=True)
+
+        assert_in('async="async"', challenge_markup)
+        assert_in('defer="defer"', challenge_markup)
+        assert_in('/recaptcha/api/js/recaptcha_ajax.js', challenge_markup)
+        assert_in(
+            'onload="Recaptcha.create(&quot;public key&quot;',
+            challenge_markup,
+            )
+
+    def test_previous_solution_incorrect(self):
+        challenge_markup = self.client.get_challenge_markup(
+            was_previous_solution_incorrect=True,
+            load_asynchronously=True,
+            )
+
+        assert_in(
+            'RecaptchaOptions.extra_challenge_params='
+            '"error=incorrect-captcha-sol";',
+            challenge_markup,
+            )
+        assert_in('error=incorrect-captcha-sol" height', challenge_markup)
+
+    def test_previous_solution_correct(self):
+        challenge_markup = \
+            self.client.get_challenge_markup(load_asynchronously=True)
+
+        assert_not_in('error=incorrect-captcha-sol', challenge_markup)
+
+    def test_caching(self):
+        challenge_markup = \
+            self.client.get_challenge_markup(load_asynchronously=True)
+
+        ok_(
+            challenge_markup is
+            self.client.get_challenge_markup(load_asynchronously=True)
+            )
+        assert_not_equal(
+            challenge_markup,
+            self.client.get_challenge_markup(load_asynchronously=False),
+            )
+
+
+class TestChallengeLoaderMarkup(object):
+
+    def setup(self):
+        self.client = _OfflineVerificationClient()
+
+    def test_single_script(self):
+        challenge_loader_markup = self.client.get_challenge_loader_markup()
+
+        eq_(1, challenge_loader_markup.count('<script'))
+        eq_(1, challenge_loader_markup.count('var RecaptchaOptions='))
+        assert_not_in('<noscript>', challenge_loader_markup)
+
+    def test_lazy_api_loading(self):
+        challenge_loader_markup = \
+            self.client.get_challenge_loader_markup(use_ssl=True)
+
+        assert_in(
+            's.src="https://www.google.com/recaptcha/api/js/recaptcha_ajax.js"',
+            challenge_loader_markup,
+            )
+        assert_in('Recaptcha.create("public key",', challenge_loader_markup)
+        assert_in('.recaptcha_placeholder', challenge_loader_markup)
+
+    def test_previous_solution_incorrect(self):
+        challenge_loader_markup = \
+            self.client.get_challenge_loader_markup(True)
+
+        assert_in(
+            'RecaptchaOptions.extra_challenge_params='
+            '"error=incorrect-captcha-sol";',
+            challenge_loader_markup,
+            )
+
+    def test_caching(self):
+        challenge_loader_markup = self.client.get_challenge_loader_markup()
+
+        ok_(
+            challenge_loader_markup is
+            self.client.get_challenge_loader_markup()
+            )
+        assert_not_equal(
+            challenge_loader_markup,
+            self.client.get_challenge_loader_markup(use_ssl=True),
+            )
+
+    def test_placeholder(self):
+        challenge_placeholder_markup = \
+            self.client.get_challenge_placeholder_markup('login_captcha')
+
+        ok_(
+            challenge_placeholder_markup.startswith(
+                '<div id="login_captcha" class="recaptcha_placeholder"></div>'
+                '<noscript>',
+                ),
+            )
+        assert_not_in('<script', challenge_placeholder_markup)
+
+    def test_placeholder_identifier_escaping(self):
+        challenge_placeholder_markup = \
+            self.client.get_challenge_placeholder_markup('"captcha"')
+
+        assert_in('id="&quot;captcha&quot;"', challenge_placeholder_markup)
+
+    def test_placeholder_previous_solution_incorrect(self):
+        challenge_placeholder_markup = \
+            self.client.get_challenge_placeholder_markup(
+                'login_captcha',
+                was_previous_solution_incorrect=True,
+                use_ssl=True,
+                )
+
+        assert_in(
+            'https://www.google.com/recaptcha/api/noscript?',
+            challenge_placeholder_markup,
+            )
+        assert_in('error=incorrect-captcha-sol', challenge_placeholder_markup)
+
+
+class TestChallengeMarkupCompression(object):
+
+    def setup(self):
+        self.client = _OfflineVerificationClient()
+
+    def test_gzip(self):
+        compressed_challenge_markup = \
+            self.client.get_compressed_challenge_markup('gzip', use_ssl=True)
+
+        eq_(
+            self.client.get_challenge_markup(use_ssl=True),
+            zlib.decompress(compressed_challenge_markup, 16 + zlib.MAX_WBITS),
+            )
+
+    def test_deflate(self):
+        compressed_challenge_markup = \
+            self.client.get_compressed_challenge_markup(
+                'deflate',
+                load_asynchronously=True,
+                )
+
+        eq_(
+            self.client.get_challenge_markup(load_asynchronously=True),
+            zlib.decompress(compressed_challenge_markup),
+            )
+
+    def test_determinism(self):
+        other_client = _OfflineVerificationClient()
+
+        eq_(
+            self.client.get_compressed_challenge_markup('gzip'),
+            other_client.get_compressed_challenge_markup('gzip'),
+            )
+
+    def test_unsupported_content_coding(self):
+        with assert_raises(ValueError):
+            self.client.get_compressed_challenge_markup('br')
+
+
+class TestChallengeMarkupRendering(object):
+
+    def setup(self):
+        self.output_directory_path = mkdtemp()
+
+    def teardown(self):
+        rmtree(self.output_directory_path)
+
+    def test_default_profile(self):
+        manifest = self._render_challenge_markup('-k', _FAKE_PUBLIC_KEY)
+
+        eq_([_FAKE_PUBLIC_KEY], manifest.keys())
+        eq_(['default'], manifest[_FAKE_PUBLIC_KEY].keys())
+
+        file_names_by_variant_name = manifest[_FAKE_PUBLIC_KEY]['default']
+        eq_(8, len(file_names_by_variant_name))
+
+        client = RecaptchaClient(_FAKE_PRIVATE_KEY, _FAKE_PUBLIC_KEY)
+        file_name = file_names_by_variant_name['https-incorrect-async']
+        eq_(
+            client.get_challenge_markup(True, True, True),
+            self._read_file(_FAKE_PUBLIC_KEY, 'default', file_name),
+            )
+        eq_(
+            client.get_compressed_challenge_markup('gzip', True, True, True),
+            self._read_file(_FAKE_PUBLIC_KEY, 'default', file_name + '.gz'),
+            )
+
+    def test_content_hashes(self):
+        manifest = self._render_challenge_markup('-k', _FAKE_PUBLIC_KEY)
+
+        file_names_by_variant_name = manifest[_FAKE_PUBLIC_KEY]['default']
+        file_names = file_names_by_variant_name.values()
+        eq_(len(file_names), len(set(file_names)))
+        for variant_name, file_name in file_names_by_variant_name.items():
+            ok_(file_name.startswith(variant_name + '.'))
+
+    def test_options_profiles(self):
+        manifest = self._render_challenge_markup(
+            '-k',
+            _FAKE_PUBLIC_KEY,
+            '-k',
+            'other key',
+            '-p',
+            'clean={"theme": "clean"}',
+            '-p',
+            'red={}',
+            )
+
+        eq_(set([_FAKE_PUBLIC_KEY, 'other key']), set(manifest))
+        file_name = manifest['other key']['clean']['http-initial-sync']
+        challenge_markup = self._read_file('other key', 'clean', file_name)
+        assert_in('"theme": "clean"', challenge_markup)
+
+    def test_missing_public_key(self):
+        with assert_raises(SystemExit):
+            _main(['render', '-o', self.output_directory_path])
+
+    def test_invalid_options_profile(self):
+        with assert_raises(SystemExit):
+            self._render_challenge_markup('-k', _FAKE_PUBLIC_KEY, '-p', 'a={')
+
+    def test_profile_names_outside_directory(self):
+        for profile_name in ('.', '..', 'a/b', ''):
+            with assert_raises(SystemExit):
+                self._render_challenge_markup(
+                    '-k',
+                    _FAKE_PUBLIC_KEY,
+                    '-p',
+                    profile_name + '={}',
+                    )
+
+    def test_public_keys_outside_directory(self):
+        for public_key in ('.', '..', ''):
+            with assert_raises(SystemExit):
+                self._render_challenge_markup('-k', public_key)
+
+    def _render_challenge_markup(self, *arguments):
+        _main(['render', '-o', self.output_directory_path] + list(arguments))
+
+        manifest_file_path = \
+            path.join(self.output_directory_path, 'manifest.json')
+        with open(manifest_file_path) as manifest_file:
+            manifest = json_decode(manifest_file.read())
+        return manifest
+
+    def _read_file(self, public_key, profile_name, file_name):
+        file_path = path.join(
+            self.output_directory_path,
+            public_key.replace(' ', '%20'),
+            profile_name,
+            file_name,
+            )
+        with open(file_path, 'rb') as file_:
+            file_contents = file_.read()
+        return file_contents
+
+
 #}
 
 
@@ -217,10 +548,13 @@ class TestSolutionVerification(object):
         eq_(0, client.communication_attempts)
 
     def test_invalid_private_key(self):
-        invalid_private_key_result = {
-            'is_solution_correct': False,
-            'error_code': 'invalid-site-private-key',
-            }
+        invalid_private_key_result = VerificationResult(
+            False,
+            'invalid-site-private-key',
+            0.1,
+            1,
+            False,
+            )
         client = _OfflineVerificationClient(invalid_private_key_result)
 
         with assert_raises_regexp(
@@ -234,10 +568,13 @@ class TestSolutionVerification(object):
                 )
 
     def test_invalid_challenge(self):
-        invalid_challenge_result = {
-            'is_solution_correct': False,
-            'error_code': 'invalid-request-cookie',
-            }
+        invalid_challenge_result = VerificationResult(
+            False,
+            'invalid-request-cookie',
+            0.1,
+            1,
+            False,
+            )
         client = _OfflineVerificationClient(invalid_challenge_result)
 
         with assert_raises_regexp(
@@ -270,72 +607,1379 @@ class TestSolutionVerification(object):
             )
         assert_false(is_solution_correct)
 
+    def test_verification_result(self):
+        client = _OfflineVerificationClient(_INCORRECT_SOLUTION_RESULT)
 
-class TestSolutionEncoding(object):
+        verification_result = client.verify(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+        eq_(_INCORRECT_SOLUTION_RESULT, verification_result)
 
-    def setup(self):
-        self.client = _SolutionCapturingClient()
+    def test_verification_result_for_empty_solution(self):
+        client = _OfflineVerificationClient(_CORRECT_SOLUTION_RESULT)
 
-    def test_utf8_input(self):
-        solution_utf8 = u'profesión'.encode('utf8')
+        verification_result = client.verify(
+            '',
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+        assert_false(verification_result.is_solution_correct)
+        eq_('incorrect-captcha-sol', verification_result.error_code)
+        eq_(0, verification_result.attempt_count)
+        eq_(0, client.communication_attempts)
 
-        self.client.is_solution_correct(
-            solution_utf8,
+
+class TestVerificationResult(object):
+
+    def test_immutability(self):
+        with assert_raises(AttributeError):
+            _CORRECT_SOLUTION_RESULT.is_solution_correct = False
+
+        with assert_raises(AttributeError):
+            del _CORRECT_SOLUTION_RESULT.error_code
+
+    def test_no_instance_dictionary(self):
+        assert_false(hasattr(_CORRECT_SOLUTION_RESULT, '__dict__'))
+
+    def test_equality(self):
+        eq_(
+            VerificationResult(True, None, 0.1, 1, False),
+            _CORRECT_SOLUTION_RESULT,
+            )
+        assert_not_equal(_INCORRECT_SOLUTION_RESULT, _CORRECT_SOLUTION_RESULT)
+
+    def test_representation(self):
+        result_repr = repr(_INCORRECT_SOLUTION_RESULT)
+
+        ok_(result_repr.startswith('VerificationResult('))
+        assert_in("error_code='incorrect-captcha-sol'", result_repr)
+
+
+class TestAPIFailover(object):
+
+    def test_challenge_markup_api_url(self):
+        client = _ScriptedAPIClient({})
+
+        challenge_markup = client.get_challenge_markup(use_ssl=True)
+
+        assert_in('https://primary.example.com/', challenge_markup)
+        assert_not_in('secondary.example.com', challenge_markup)
+
+    def test_preferred_api(self):
+        client = _ScriptedAPIClient({
+            _PRIMARY_API_URL: [(True, None)],
+            _SECONDARY_API_URL: [],
+            })
+
+        verification_result = client.verify(
+            _FAKE_SOLUTION_TEXT,
             _FAKE_CHALLENGE_ID,
             _RANDOM_REMOTE_IP,
             )
 
-        solution_bytestring = solution_utf8.decode('utf8')
-        eq_(solution_bytestring, self.client.solution_text_decoded)
+        ok_(verification_result.is_solution_correct)
+        eq_(1, verification_result.attempt_count)
+        eq_(['primary.example.com'], client.contacted_hosts)
 
-    def test_ascii_input(self):
-        solution_ascii = 'profession'
+    def test_unreachable_api(self):
+        client = _ScriptedAPIClient({
+            _PRIMARY_API_URL: [SocketError('Connection refused')],
+            _SECONDARY_API_URL: [(False, 'incorrect-captcha-sol')],
+            })
 
-        self.client.is_solution_correct(
-            solution_ascii,
+        verification_result = client.verify(
+            _FAKE_SOLUTION_TEXT,
             _FAKE_CHALLENGE_ID,
             _RANDOM_REMOTE_IP,
             )
 
-        eq_(solution_ascii, self.client.solution_text_decoded)
+        assert_false(verification_result.is_solution_correct)
+        eq_('incorrect-captcha-sol', verification_result.error_code)
+        eq_(2, verification_result.attempt_count)
+        eq_(
+            ['primary.example.com', 'secondary.example.com'],
+            client.contacted_hosts,
+            )
 
-    def test_input_in_unsupported_encoding(self):
-        solution_utf8 = u'profesión'.encode('utf8')
-        solution_bytestring = solution_utf8.decode('utf8')
-        solution_latin1 = solution_bytestring.encode('latin1')
+    def test_api_unable_to_reach_recaptcha(self):
+        client = _ScriptedAPIClient({
+            _PRIMARY_API_URL: [(False, 'recaptcha-not-reachable')],
+            _SECONDARY_API_URL: [(True, None)],
+            })
 
-        with assert_raises(UnicodeDecodeError):
-            self.client.is_solution_correct(
-                solution_latin1,
+        verification_result = client.verify(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        ok_(verification_result.is_solution_correct)
+        eq_(2, verification_result.attempt_count)
+
+    def test_all_apis_unreachable(self):
+        client = _ScriptedAPIClient({
+            _PRIMARY_API_URL: [SocketError('Connection refused')],
+            _SECONDARY_API_URL: [SocketError('Connection refused')],
+            })
+
+        with assert_raises_regexp(RecaptchaUnreachableError, 'refused'):
+            client.verify(
+                _FAKE_SOLUTION_TEXT,
                 _FAKE_CHALLENGE_ID,
                 _RANDOM_REMOTE_IP,
                 )
 
+    def test_verification_timeout_exceeded(self):
+        client = _ScriptedAPIClient({_PRIMARY_API_URL: [(True, None)]}, 0)
 
-#{ Stubs
+        with assert_raises(RecaptchaUnreachableError):
+            client.verify(
+                _FAKE_SOLUTION_TEXT,
+                _FAKE_CHALLENGE_ID,
+                _RANDOM_REMOTE_IP,
+                )
+        eq_([], client.contacted_hosts)
+
+    def test_api_timeout(self):
+        client = _ScriptedAPIClient(
+            {
+                _PRIMARY_API_URL: [SocketTimeout('timed out')],
+                _SECONDARY_API_URL: [(True, None)],
+                },
+            1,
+            )
 
+        verification_result = client.verify(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
 
-class _OfflineVerificationClient(RecaptchaClient):
+        ok_(verification_result.is_solution_correct)
+        eq_(2, verification_result.attempt_count)
+        ok_(verification_result.elapsed_time < 1)
 
-    def __init__(self, verification_result=None):
-        super(_OfflineVerificationClient, self).__init__(
-            _FAKE_PRIVATE_KEY,
-            _FAKE_PUBLIC_KEY,
+    def test_failing_api_avoided(self):
+        client = _ScriptedAPIClient({
+            _PRIMARY_API_URL: [SocketError('Connection refused')],
+            _SECONDARY_API_URL: [(True, None), (True, None)],
+            })
+
+        for _ in range(2):
+            client.verify(
+                _FAKE_SOLUTION_TEXT,
+                _FAKE_CHALLENGE_ID,
+                _RANDOM_REMOTE_IP,
+                )
+
+        eq_(
+            ['primary.example.com', 'secondary.example.com',
+             'secondary.example.com'],
+            client.contacted_hosts,
             )
 
-        self.verification_result = verification_result
-        self.communication_attempts = 0
 
-    def _get_recaptcha_response_for_solution(
-        self,
-        solution_text_decoded,
-        challenge_id,
-        remote_ip,
-        ):
+class TestAPIEndpointHealth(object):
 
-        self.communication_attempts += 1
+    def test_unused_endpoint(self):
+        api_endpoint = _RecaptchaAPIEndpoint(_PRIMARY_API_URL)
 
-        return self.verification_result
+        eq_(0, api_endpoint.get_cost(100))
+
+    def test_verification_url(self):
+        api_endpoint = _RecaptchaAPIEndpoint(_PRIMARY_API_URL)
+
+        eq_(
+            'https://primary.example.com/recaptcha/api/verify',
+            api_endpoint.verification_url,
+            )
+
+    def test_latency(self):
+        api_endpoint = _RecaptchaAPIEndpoint(_PRIMARY_API_URL)
+
+        api_endpoint.record_success(100, 1.0)
+        eq_(1.0, api_endpoint.get_cost(100))
+
+        api_endpoint.record_success(101, 2.0)
+        ok_(1.0 < api_endpoint.get_cost(101) < 2.0)
+
+    def test_failures(self):
+        fast_api_endpoint = _RecaptchaAPIEndpoint(_PRIMARY_API_URL)
+        fast_api_endpoint.record_success(100, 0.1)
+        fast_api_endpoint.record_failure(100)
+
+        slow_api_endpoint = _RecaptchaAPIEndpoint(_SECONDARY_API_URL)
+        slow_api_endpoint.record_success(100, 0.5)
+
+        ok_(fast_api_endpoint.get_cost(100) > slow_api_endpoint.get_cost(100))
+
+    def test_failure_decay(self):
+        api_endpoint = _RecaptchaAPIEndpoint(_PRIMARY_API_URL)
+        api_endpoint.record_failure(100)
+
+        cost_after_failure = api_endpoint.get_cost(100)
+        eq_(cost_after_failure / 2, api_endpoint.get_cost(160))
+
+
+class TestAuditLog(object):
+
+    def setup(self):
+        self.log_directory_path = mkdtemp()
+        self.log_file_path = path.join(self.log_directory_path, 'audit.log')
+        self.audit_logs = []
+
+    def teardown(self):
+        for audit_log in self.audit_logs:
+            audit_log.close()
+        rmtree(self.log_directory_path)
+
+    def test_record_format(self):
+        audit_log = self._make_audit_log()
+
+        audit_log.record(1350000000.5, _RANDOM_REMOTE_IP, True, None)
+        audit_log.record(
+            1350000001.25,
+            _RANDOM_REMOTE_IP,
+            False,
+            'incorrect-captcha-sol',
+            )
+        audit_log.flush()
+
+        eq_(
+            [
+                '1350000000.500\t192.0.2.0\t1\t-',
+                '1350000001.250\t192.0.2.0\t0\tincorrect-captcha-sol',
+                ],
+            self._read_log_lines(),
+            )
+        eq_(2, audit_log.written_record_count)
+        eq_(0, audit_log.dropped_record_count)
+
+    def test_non_ascii_fields(self):
+        audit_log = self._make_audit_log()
+
+        audit_log.record(1, u'192.0.2.\xe9', False, u'caf\xe9')
+        audit_log.flush()
+
+        eq_(
+            ['1.000\t192.0.2.\\xe9\t0\tcaf\\xe9'],
+            self._read_log_lines(),
+            )
+        eq_(1, audit_log.written_record_count)
+
+    def test_forged_records(self):
+        audit_log = self._make_audit_log()
+
+        audit_log.record(1, '192.0.2.0\n2.000\t192.0.2.1', True, None)
+        audit_log.flush()
+
+        eq_(
+            ['1.000\t192.0.2.0\\n2.000\\t192.0.2.1\t1\t-'],
+            self._read_log_lines(),
+            )
+
+    def test_dropping_newest_records(self):
+        audit_log = self._make_audit_log(capacity=2)
+
+        for timestamp in (1, 2, 3):
+            audit_log.record(timestamp, _RANDOM_REMOTE_IP, True, None)
+        audit_log.flush()
+
+        eq_(['1.000', '2.000'], self._read_log_timestamps())
+        eq_(1, audit_log.dropped_record_count)
+
+    def test_dropping_oldest_records(self):
+        audit_log = self._make_audit_log(capacity=2, drop_policy='drop-oldest')
+
+        for timestamp in (1, 2, 3):
+            audit_log.record(timestamp, _RANDOM_REMOTE_IP, True, None)
+        audit_log.flush()
+
+        eq_(['2.000', '3.000'], self._read_log_timestamps())
+        eq_(1, audit_log.dropped_record_count)
+
+    def test_unknown_drop_policy(self):
+        with assert_raises(ValueError):
+            self._make_audit_log(drop_policy='block')
+
+    def test_rotation(self):
+        # Each record takes 20 bytes
+        audit_log = self._make_audit_log(max_file_size=40, backup_count=2)
+
+        for timestamp in (1, 2, 3, 4, 5, 6, 7):
+            audit_log.record(timestamp, _RANDOM_REMOTE_IP, True, None)
+            audit_log.flush()
+
+        eq_(['7.000'], self._read_log_timestamps())
+        eq_(
+            ['5.000', '6.000'],
+            self._read_log_timestamps(self.log_file_path + '.1'),
+            )
+        eq_(
+            ['3.000', '4.000'],
+            self._read_log_timestamps(self.log_file_path + '.2'),
+            )
+        assert_false(path.exists(self.log_file_path + '.3'))
+
+    def test_rotation_without_backups(self):
+        audit_log = self._make_audit_log(max_file_size=40, backup_count=0)
+
+        for timestamp in (1, 2, 3):
+            audit_log.record(timestamp, _RANDOM_REMOTE_IP, True, None)
+            audit_log.flush()
+
+        eq_(['1.000', '2.000', '3.000'], self._read_log_timestamps())
+        assert_false(path.exists(self.log_file_path + '.1'))
+
+    def test_failed_rotation(self):
+        audit_log = self._make_audit_log(max_file_size=20, backup_count=1)
+        rmtree(self.log_directory_path)
+
+        audit_log.record(1, _RANDOM_REMOTE_IP, True, None)
+        audit_log.flush()
+        audit_log.record(2, _RANDOM_REMOTE_IP, True, None)
+        audit_log.flush()
+
+        eq_(1, audit_log.written_record_count)
+        eq_(1, audit_log.dropped_record_count)
+
+        mkdir(self.log_directory_path)
+        audit_log.record(3, _RANDOM_REMOTE_IP, True, None)
+        audit_log.flush()
+
+        eq_(2, audit_log.written_record_count)
+        eq_(
+            ['3.000'],
+            self._read_log_timestamps(self.log_file_path + '.1'),
+            )
+
+    def test_concurrent_recording(self):
+        audit_log = self._make_audit_log(capacity=100)
+
+        def record_verifications():
+            for timestamp in range(1000):
+                audit_log.record(timestamp, _RANDOM_REMOTE_IP, True, None)
+
+        recording_threads = \
+            [Thread(target=record_verifications) for _ in range(4)]
+        for recording_thread in recording_threads:
+            recording_thread.start()
+        for recording_thread in recording_threads:
+            recording_thread.join()
+        audit_log.flush()
+
+        eq_(100, len(self._read_log_lines()))
+        eq_(3900, audit_log.dropped_record_count)
+
+    def test_closing(self):
+        audit_log = RecaptchaAuditLog(self.log_file_path, flush_interval=3600)
+
+        audit_log.record(1, _RANDOM_REMOTE_IP, True, None)
+        audit_log.close()
+
+        eq_(['1.000'], self._read_log_timestamps())
+
+    def test_client_verification(self):
+        audit_log = self._make_audit_log()
+        client = _OfflineVerificationClient(_INCORRECT_SOLUTION_RESULT)
+        client.audit_log = audit_log
+
+        client.verify(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+        client.verify('', _FAKE_CHALLENGE_ID, _RANDOM_REMOTE_IP)
+        audit_log.flush()
+
+        log_lines = self._read_log_lines()
+        eq_(2, len(log_lines))
+        for log_line in log_lines:
+            ok_(log_line.endswith('\t192.0.2.0\t0\tincorrect-captcha-sol'))
+
+    def test_client_unreachable_api(self):
+        audit_log = self._make_audit_log()
+        client = _ScriptedAPIClient({
+            _PRIMARY_API_URL: [SocketError('Connection refused')],
+            _SECONDARY_API_URL: [SocketError('Connection refused')],
+            })
+        client.audit_log = audit_log
+
+        with assert_raises(RecaptchaUnreachableError):
+            client.verify(
+                _FAKE_SOLUTION_TEXT,
+                _FAKE_CHALLENGE_ID,
+                _RANDOM_REMOTE_IP,
+                )
+        audit_log.flush()
+
+        log_line = self._read_log_lines()[0]
+        ok_(log_line.endswith('\t0\trecaptcha-not-reachable'))
+
+    def _make_audit_log(self, **kwargs):
+        audit_log = RecaptchaAuditLog(
+            self.log_file_path,
+            flush_interval=3600,
+            **kwargs
+            )
+        self.audit_logs.append(audit_log)
+        return audit_log
+
+    def _read_log_lines(self, log_file_path=None):
+        with open(log_file_path or self.log_file_path) as log_file:
+            log_lines = log_file.read().splitlines()
+        return log_lines
+
+    def _read_log_timestamps(self, log_file_path=None):
+        log_timestamps = [
+            log_line.split('\t')[0]
+            for log_line in self._read_log_lines(log_file_path)
+            ]
+        return log_timestamps
+
+
+class TestChallengeGate(object):
+
+    def test_unknown_ip(self):
+        challenge_gate = RecaptchaChallengeGate()
+
+        assert_false(challenge_gate.should_challenge(_RANDOM_REMOTE_IP))
+
+    def test_attempt_threshold(self):
+        challenge_gate = RecaptchaChallengeGate(attempt_threshold=3)
+
+        for _ in range(2):
+            challenge_gate.record_attempt(_RANDOM_REMOTE_IP)
+        assert_false(challenge_gate.should_challenge(_RANDOM_REMOTE_IP))
+
+        challenge_gate.record_attempt(_RANDOM_REMOTE_IP)
+        ok_(challenge_gate.should_challenge(_RANDOM_REMOTE_IP))
+
+    def test_failure_threshold(self):
+        challenge_gate = RecaptchaChallengeGate(failure_threshold=2)
+
+        challenge_gate.record_attempt(_RANDOM_REMOTE_IP, is_failure=True)
+        assert_false(challenge_gate.should_challenge(_RANDOM_REMOTE_IP))
+
+        challenge_gate.record_attempt(_RANDOM_REMOTE_IP, is_failure=True)
+        ok_(challenge_gate.should_challenge(_RANDOM_REMOTE_IP))
+
+    def test_other_ips(self):
+        challenge_gate = RecaptchaChallengeGate(attempt_threshold=1)
+
+        challenge_gate.record_attempt(_RANDOM_REMOTE_IP)
+
+        ok_(challenge_gate.should_challenge(_RANDOM_REMOTE_IP))
+        assert_false(challenge_gate.should_challenge('198.51.100.1'))
+
+
+class TestDecayingCountMinSketch(object):
+
+    def test_empty_sketch(self):
+        sketch = _DecayingCountMinSketch(16, 2, 60)
+
+        eq_(0, sketch.get_estimate(_RANDOM_REMOTE_IP, 100))
+
+    def test_counting(self):
+        sketch = _DecayingCountMinSketch(16, 2, 60)
+
+        for _ in range(3):
+            sketch.add(_RANDOM_REMOTE_IP, 100)
+
+        eq_(3, sketch.get_estimate(_RANDOM_REMOTE_IP, 100))
+
+    def test_decay(self):
+        sketch = _DecayingCountMinSketch(16, 2, 60)
+
+        sketch.add(_RANDOM_REMOTE_IP, 100)
+        sketch.add(_RANDOM_REMOTE_IP, 160)
+
+        eq_(1.5, sketch.get_estimate(_RANDOM_REMOTE_IP, 160))
+        eq_(0.75, sketch.get_estimate(_RANDOM_REMOTE_IP, 220))
+
+    def test_rescaling(self):
+        sketch = _DecayingCountMinSketch(16, 2, 1)
+
+        sketch.add(_RANDOM_REMOTE_IP, 0)
+        sketch.add(_RANDOM_REMOTE_IP, 30)
+        sketch.add(_RANDOM_REMOTE_IP, 31)
+
+        eq_(0.5 + 1 + 2 ** -31, sketch.get_estimate(_RANDOM_REMOTE_IP, 31))
+        eq_(30, sketch._landmark_time)
+
+    def test_long_inactivity(self):
+        sketch = _DecayingCountMinSketch(16, 2, 60)
+
+        sketch.add(_RANDOM_REMOTE_IP, 0)
+
+        eq_(0, sketch.get_estimate(_RANDOM_REMOTE_IP, 60 * 1100))
+
+        sketch.add(_RANDOM_REMOTE_IP, 60 * 1100)
+
+        eq_(1, sketch.get_estimate(_RANDOM_REMOTE_IP, 60 * 1100))
+        eq_(60 * 1100, sketch._landmark_time)
+
+    def test_estimation_during_rescaling(self):
+        sketch = _DecayingCountMinSketch(1000, 2, 1)
+        sketch.add(_RANDOM_REMOTE_IP, 0)
+        latest_addition_times = [0]
+        estimates = []
+
+        def add_periodically():
+            for addition_time in range(20, 20 * 200, 20):
+                sketch.add(_RANDOM_REMOTE_IP, addition_time)
+                latest_addition_times[0] = addition_time
+
+        addition_thread = Thread(target=add_periodically)
+        addition_thread.start()
+        while addition_thread.is_alive():
+            estimate = \
+                sketch.get_estimate(_RANDOM_REMOTE_IP, latest_addition_times[0])
+            estimates.append(estimate)
+        addition_thread.join()
+
+        ok_(1 <= min(estimates))
+
+    def test_no_underestimation(self):
+        sketch = _DecayingCountMinSketch(8, 2, 60)
+
+        remote_ips = ['192.0.2.{0}'.format(index) for index in range(100)]
+        for index, remote_ip in enumerate(remote_ips):
+            for _ in range(index % 5):
+                sketch.add(remote_ip, 100)
+
+        for index, remote_ip in enumerate(remote_ips):
+            ok_(index % 5 <= sketch.get_estimate(remote_ip, 100))
+
+
+class TestVerifyMany(object):
+
+    def test_results_order(self):
+        client = _SlowVerificationClient()
+
+        verification_outcomes = client.verify_many([
+            ('correct', '0.03', _RANDOM_REMOTE_IP),
+            ('incorrect', '0.01', _RANDOM_REMOTE_IP),
+            ('correct', '0.02', _RANDOM_REMOTE_IP),
+            ])
+
+        eq_(
+            [True, False, True],
+            [outcome.is_solution_correct for outcome in verification_outcomes],
+            )
+
+    def test_exceptions(self):
+        client = _SlowVerificationClient()
+
+        verification_outcomes = client.verify_many([
+            ('correct', '0', _RANDOM_REMOTE_IP),
+            ('invalid-request-cookie', '0', _RANDOM_REMOTE_IP),
+            ])
+
+        correct_solution_outcome, invalid_challenge_outcome = \
+            verification_outcomes
+        ok_(correct_solution_outcome.is_solution_correct)
+        assert_is_instance(
+            invalid_challenge_outcome,
+            RecaptchaInvalidChallengeError,
+            )
+
+    def test_no_solutions(self):
+        client = _SlowVerificationClient()
+
+        eq_([], client.verify_many([]))
+
+    def test_completion_order(self):
+        client = _SlowVerificationClient()
+
+        verification_outcomes = client.iter_verify_many([
+            ('correct', '0.1', _RANDOM_REMOTE_IP),
+            ('incorrect', '0', _RANDOM_REMOTE_IP),
+            ])
+
+        eq_([1, 0], [index for index, _ in verification_outcomes])
+
+    def test_parallelism(self):
+        client = _SlowVerificationClient()
+
+        client.verify_many(
+            [('correct', '0.02', _RANDOM_REMOTE_IP)] * 10,
+            max_parallelism=3,
+            )
+
+        eq_(3, client.max_concurrent_verifications)
+
+    def test_sequential_verification(self):
+        client = _SlowVerificationClient()
+
+        client.verify_many(
+            [('correct', '0.01', _RANDOM_REMOTE_IP)] * 3,
+            max_parallelism=1,
+            )
+
+        eq_(1, client.max_concurrent_verifications)
+
+    def test_invalid_parallelism(self):
+        client = _SlowVerificationClient()
+        verification_arguments = [('correct', '0', _RANDOM_REMOTE_IP)]
+
+        with assert_raises(ValueError):
+            client.verify_many(verification_arguments, max_parallelism=0)
+        with assert_raises(ValueError):
+            client.iter_verify_many(verification_arguments, max_parallelism=0)
+
+
+class TestHedging(object):
+
+    def test_slow_response(self):
+        client = _DelayedResponsesClient([
+            (0.5, (False, 'incorrect-captcha-sol')),
+            (0, (True, None)),
+            ])
+
+        verification_result = client.verify(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        ok_(verification_result.is_solution_correct)
+        ok_(verification_result.was_request_hedged)
+        eq_(1, verification_result.attempt_count)
+        ok_(verification_result.elapsed_time < 0.5)
+        self._assert_hedging_statistics(client, 1, 1, 1)
+
+    def test_fast_response(self):
+        client = _DelayedResponsesClient([
+            (0, (True, None)),
+            (0, (False, 'incorrect-captcha-sol')),
+            ])
+
+        verification_result = client.verify(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        ok_(verification_result.is_solution_correct)
+        assert_false(verification_result.was_request_hedged)
+        self._assert_hedging_statistics(client, 1, 0, 0)
+
+    def test_original_request_answered_first(self):
+        client = _DelayedResponsesClient([
+            (0.1, (True, None)),
+            (0.5, (False, 'incorrect-captcha-sol')),
+            ])
+
+        verification_result = client.verify(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        ok_(verification_result.is_solution_correct)
+        ok_(verification_result.was_request_hedged)
+        self._assert_hedging_statistics(client, 1, 1, 0)
+
+    def test_hedge_rejected_first(self):
+        client = _DelayedResponsesClient([
+            (0.2, (True, None)),
+            (0, (False, 'incorrect-captcha-sol')),
+            ])
+
+        verification_result = client.verify(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        ok_(verification_result.is_solution_correct)
+        ok_(verification_result.was_request_hedged)
+        self._assert_hedging_statistics(client, 1, 1, 0)
+
+    def test_original_request_rejected_first(self):
+        client = _DelayedResponsesClient([
+            (0.1, (False, 'incorrect-captcha-sol')),
+            (0.15, (True, None)),
+            ])
+
+        verification_result = client.verify(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        ok_(verification_result.is_solution_correct)
+        ok_(verification_result.was_request_hedged)
+        self._assert_hedging_statistics(client, 1, 1, 1)
+
+    def test_both_requests_rejected(self):
+        client = _DelayedResponsesClient([
+            (0.1, (False, 'invalid-request-cookie')),
+            (0.15, (False, 'incorrect-captcha-sol')),
+            ])
+
+        with assert_raises(RecaptchaInvalidChallengeError):
+            client.verify(
+                _FAKE_SOLUTION_TEXT,
+                _FAKE_CHALLENGE_ID,
+                _RANDOM_REMOTE_IP,
+                )
+        self._assert_hedging_statistics(client, 1, 1, 0)
+
+    def test_hedge_rejected_and_original_failed(self):
+        client = _DelayedResponsesClient([
+            (0.2, SocketError('Connection reset')),
+            (0, (False, 'incorrect-captcha-sol')),
+            ])
+
+        verification_result = client.verify(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        assert_false(verification_result.is_solution_correct)
+        self._assert_hedging_statistics(client, 1, 1, 1)
+
+    def test_hedge_timeout(self):
+        client = _DelayedResponsesClient(
+            [(0.1, (True, None)), (0, (True, None))],
+            verification_timeout=1,
+            )
+
+        client.verify(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        original_timeout, hedge_timeout = client.timeouts
+        ok_(0.95 < original_timeout <= 1)
+        ok_(hedge_timeout <= original_timeout - 0.02)
+
+    def test_failed_hedge(self):
+        client = _DelayedResponsesClient([
+            (0.1, (True, None)),
+            (0, SocketError('Connection refused')),
+            ])
+
+        verification_result = client.verify(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        ok_(verification_result.is_solution_correct)
+
+    def test_failed_requests(self):
+        client = _DelayedResponsesClient([
+            (0.1, SocketError('Connection refused')),
+            (0, SocketError('Connection reset')),
+            ])
+
+        with assert_raises(RecaptchaUnreachableError):
+            client.verify(
+                _FAKE_SOLUTION_TEXT,
+                _FAKE_CHALLENGE_ID,
+                _RANDOM_REMOTE_IP,
+                )
+
+    def test_hedging_ratio(self):
+        client = _DelayedResponsesClient(
+            [(0.05, (True, None)), (0.05, (True, None)), (0, (True, None))],
+            hedging_ratio=0.5,
+            )
+
+        for _ in range(2):
+            client.verify(
+                _FAKE_SOLUTION_TEXT,
+                _FAKE_CHALLENGE_ID,
+                _RANDOM_REMOTE_IP,
+                )
+
+        self._assert_hedging_statistics(client, 2, 1, 1)
+
+    def test_unused_hedges_limit(self):
+        hedging_statistics = HedgingStatistics()
+        for _ in range(100000):
+            hedging_statistics.record_request()
+
+        hedged_request_count = 0
+        for _ in range(1000):
+            hedging_statistics.record_request()
+            if hedging_statistics.record_hedge(0.05):
+                hedged_request_count += 1
+
+        ok_(50 <= hedged_request_count <= 55)
+
+    def test_hedging_disabled(self):
+        client = _DelayedResponsesClient(
+            [(0.05, (True, None))],
+            hedging_delay=None,
+            )
+
+        verification_result = client.verify(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        assert_false(verification_result.was_request_hedged)
+        self._assert_hedging_statistics(client, 0, 0, 0)
+
+    @staticmethod
+    def _assert_hedging_statistics(
+        client,
+        request_count,
+        hedged_request_count,
+        hedge_win_count,
+        ):
+        hedging_statistics = client.hedging_statistics
+        eq_(request_count, hedging_statistics.request_count)
+        eq_(hedged_request_count, hedging_statistics.hedged_request_count)
+        eq_(hedge_win_count, hedging_statistics.hedge_win_count)
+
+
+class TestConnectionPooling(object):
+
+    def setup(self):
+        self.server = _FakeVerificationServer()
+        self.server_thread = Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+
+        self.api_url = 'http://127.0.0.1:{0}/'.format(self.server.server_port)
+        self.verification_url = self.api_url + 'verify'
+        self.client = RecaptchaClient(_FAKE_PRIVATE_KEY, _FAKE_PUBLIC_KEY)
+        self.verification_protocol = \
+            RecaptchaVerificationProtocol(_FAKE_PRIVATE_KEY, self.api_url)
+
+    def teardown(self):
+        self.client._connection_pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+
+    def test_connection_reuse(self):
+        verification_outcome, was_connection_reused = \
+            self._verify_solution('correct')
+        eq_((True, None), verification_outcome)
+        assert_false(was_connection_reused)
+
+        verification_outcome, was_connection_reused = \
+            self._verify_solution('incorrect')
+        eq_((False, 'incorrect-captcha-sol'), verification_outcome)
+        ok_(was_connection_reused)
+
+    def test_closed_connection(self):
+        self._verify_solution('correct')
+        for connections in \
+                self.client._connection_pool._idle_connections_by_key.values():
+            for connection in connections:
+                connection.sock.close()
+
+        verification_outcome, was_connection_reused = \
+            self._verify_solution('correct')
+        eq_((True, None), verification_outcome)
+        assert_false(was_connection_reused)
+
+    def test_connection_closed_by_server(self):
+        verification_outcome, _ = self._verify_solution('close')
+        eq_((False, 'incorrect-captcha-sol'), verification_outcome)
+
+        eq_({}, self.client._connection_pool._idle_connections_by_key)
+
+    def test_verification_over_http(self):
+        client = RecaptchaClient(
+            _FAKE_PRIVATE_KEY,
+            _FAKE_PUBLIC_KEY,
+            api_urls=[self.api_url],
+            verify_over_ssl=False,
+            )
+
+        verification_result = client.verify(
+            'correct',
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+        client._connection_pool.close()
+
+        ok_(verification_result.is_solution_correct)
+
+    def test_idle_connection_closed_by_server(self):
+        self._verify_solution('close-silently')
+
+        verification_outcome, was_connection_reused = \
+            self._verify_solution('correct')
+        eq_((True, None), verification_outcome)
+        assert_false(was_connection_reused)
+        eq_(
+            ['close-silently', 'correct'],
+            self.server.received_solution_texts,
+            )
+
+    def test_timeout_on_reused_connection(self):
+        self._verify_solution('correct')
+
+        start_time = time()
+        with assert_raises(SocketError):
+            self._verify_solution('slow', 0.2)
+
+        ok_(time() - start_time < 0.4)
+        eq_(['correct', 'slow'], self.server.received_solution_texts)
+
+    def test_unexpected_status(self):
+        verification_protocol = RecaptchaVerificationProtocol(
+            _FAKE_PRIVATE_KEY,
+            self.api_url + 'missing/',
+            )
+        with assert_raises(RecaptchaInvalidResponseError):
+            self.client._get_recaptcha_response_from_api(
+                self.verification_url,
+                verification_protocol.make_request(
+                    'correct',
+                    _FAKE_CHALLENGE_ID,
+                    _RANDOM_REMOTE_IP,
+                    ),
+                5,
+                )
+
+    def _verify_solution(self, solution_text, timeout=5):
+        verification_request = self.verification_protocol.make_request(
+            solution_text,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+        return self.client._get_recaptcha_response_from_api(
+            self.verification_url,
+            verification_request,
+            timeout,
+            )
+
+    def test_idle_connections_limit(self):
+        connection_pool = _HTTPConnectionPool(max_idle_connections_per_host=1)
+        connection_key = \
+            ('http', '127.0.0.1:{0}'.format(self.server.server_port))
+
+        connections = []
+        for _ in range(2):
+            connection, _ = connection_pool.acquire(connection_key, 5)
+            connection.connect()
+            connections.append(connection)
+        for connection in connections:
+            connection_pool.release(connection_key, connection)
+
+        ok_(connections[0].sock is not None)
+        ok_(connections[1].sock is None)
+
+        connection, was_connection_reused = \
+            connection_pool.acquire(connection_key, 5)
+        ok_(connection is connections[0])
+        ok_(was_connection_reused)
+
+        connection_pool.close()
+
+
+class TestVerificationProtocol(object):
+
+    def setup(self):
+        self.verification_protocol = \
+            RecaptchaVerificationProtocol(_FAKE_PRIVATE_KEY, _PRIMARY_API_URL)
+
+    def test_request(self):
+        verification_request = self.verification_protocol.make_request(
+            _FAKE_SOLUTION_TEXT,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        request_body = 'privatekey=private+key&remoteip=192.0.2.0&' \
+            'challenge=12345&response=hello+world'
+        expected_request = \
+            'POST /recaptcha/api/verify HTTP/1.1\r\n' \
+            'Host: primary.example.com\r\n' \
+            'User-Agent: {0}\r\n' \
+            'Content-Type: application/x-www-form-urlencoded\r\n' \
+            'Content-Length: {1}\r\n' \
+            '\r\n' \
+            '{2}'.format(_CLIENT_USER_AGENT, len(request_body), request_body)
+        eq_(expected_request, verification_request)
+
+    def test_non_ascii_solution(self):
+        verification_request = self.verification_protocol.make_request(
+            u'profesión',
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        request_body = verification_request.split('\r\n\r\n', 1)[1]
+        eq_(
+            [u'profesión'.encode('utf8')],
+            parse_qs(request_body)['response'],
+            )
+
+    def test_reserved_characters(self):
+        verification_request = self.verification_protocol.make_request(
+            'a&b=c',
+            'd+e',
+            _RANDOM_REMOTE_IP,
+            )
+
+        request_body = verification_request.split('\r\n\r\n', 1)[1]
+        request_data = parse_qs(request_body)
+        eq_(['a&b=c'], request_data['response'])
+        eq_(['d+e'], request_data['challenge'])
+
+
+class TestVerificationResponseParser(object):
+
+    def setup(self):
+        self.response_parser = RecaptchaVerificationResponseParser()
+
+    def test_body_with_length(self):
+        verification_outcome = self.response_parser.feed(
+            'HTTP/1.1 200 OK\r\n'
+            'Content-Type: text/plain\r\n'
+            'Content-Length: 12\r\n'
+            '\r\n'
+            'true\nsuccess',
+            )
+
+        eq_((True, None), verification_outcome)
+        assert_false(self.response_parser.will_close)
+
+    def test_incremental_parsing(self):
+        response = \
+            'HTTP/1.1 200 OK\r\n' \
+            'Content-Length: 27\r\n' \
+            '\r\n' \
+            'false\nincorrect-captcha-sol'
+
+        for response_byte in response[:-1]:
+            eq_(None, self.response_parser.feed(response_byte))
+        verification_outcome = self.response_parser.feed(response[-1])
+
+        eq_((False, 'incorrect-captcha-sol'), verification_outcome)
+
+    def test_chunked_body(self):
+        eq_(
+            None,
+            self.response_parser.feed(
+                'HTTP/1.1 200 OK\r\n'
+                'Transfer-Encoding: chunked\r\n'
+                '\r\n'
+                '6\r\nfalse\n\r\n'
+                '15;name=value\r\nincorrect-captcha-sol\r\n',
+                ),
+            )
+        verification_outcome = self.response_parser.feed('0\r\n\r\n')
+
+        eq_((False, 'incorrect-captcha-sol'), verification_outcome)
+
+    def test_body_until_connection_closed(self):
+        eq_(
+            None,
+            self.response_parser.feed('HTTP/1.0 200 OK\r\n\r\ntrue\nsuccess'),
+            )
+        ok_(self.response_parser.will_close)
+
+        eq_((True, None), self.response_parser.feed_eof())
+
+    def test_connection_close(self):
+        self.response_parser.feed(
+            'HTTP/1.1 200 OK\r\n'
+            'Connection: close\r\n'
+            'Content-Length: 4\r\n'
+            '\r\n'
+            'true',
+            )
+
+        ok_(self.response_parser.will_close)
+
+    def test_persistent_http_1_0_connection(self):
+        self.response_parser.feed(
+            'HTTP/1.0 200 OK\r\n'
+            'Connection: Keep-Alive\r\n'
+            'Content-Length: 4\r\n'
+            '\r\n'
+            'true',
+            )
+
+        assert_false(self.response_parser.will_close)
+
+    def test_incomplete_response(self):
+        self.response_parser.feed('HTTP/1.1 200 OK\r\nContent-Length: 12\r\n')
+
+        with assert_raises_regexp(RecaptchaInvalidResponseError, 'closed'):
+            self.response_parser.feed_eof()
+
+    def test_unexpected_status(self):
+        with assert_raises_regexp(RecaptchaInvalidResponseError, '500'):
+            self.response_parser.feed(
+                'HTTP/1.1 500 Internal Server Error\r\n'
+                'Content-Length: 0\r\n'
+                '\r\n',
+                )
+
+    def test_malformed_status_line(self):
+        with assert_raises(RecaptchaInvalidResponseError):
+            self.response_parser.feed('true\nsuccess\r\n\r\n')
+
+    def test_malformed_body(self):
+        with assert_raises(RecaptchaInvalidResponseError):
+            self.response_parser.feed(
+                'HTTP/1.1 200 OK\r\n'
+                'Content-Length: 5\r\n'
+                '\r\n'
+                'false',
+                )
+
+    def test_unexpected_data_after_response(self):
+        with assert_raises_regexp(RecaptchaInvalidResponseError, 'after'):
+            self.response_parser.feed(
+                'HTTP/1.1 200 OK\r\n'
+                'Content-Length: 4\r\n'
+                '\r\n'
+                'true\nsuccess',
+                )
+
+    def test_response_head_too_long(self):
+        with assert_raises(RecaptchaInvalidResponseError):
+            self.response_parser.feed(
+                'HTTP/1.1 200 OK\r\n' + 'X-Padding: a\r\n' * 10000,
+                )
+
+
+class TestSolutionEncoding(object):
+
+    def setup(self):
+        self.client = _SolutionCapturingClient()
+
+    def test_utf8_input(self):
+        solution_utf8 = u'profesión'.encode('utf8')
+
+        self.client.is_solution_correct(
+            solution_utf8,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        solution_bytestring = solution_utf8.decode('utf8')
+        eq_(solution_bytestring, self.client.solution_text_decoded)
+
+    def test_ascii_input(self):
+        solution_ascii = 'profession'
+
+        self.client.is_solution_correct(
+            solution_ascii,
+            _FAKE_CHALLENGE_ID,
+            _RANDOM_REMOTE_IP,
+            )
+
+        eq_(solution_ascii, self.client.solution_text_decoded)
+
+    def test_input_in_unsupported_encoding(self):
+        solution_utf8 = u'profesión'.encode('utf8')
+        solution_bytestring = solution_utf8.decode('utf8')
+        solution_latin1 = solution_bytestring.encode('latin1')
+
+        with assert_raises(UnicodeDecodeError):
+            self.client.is_solution_correct(
+                solution_latin1,
+                _FAKE_CHALLENGE_ID,
+                _RANDOM_REMOTE_IP,
+                )
+
+
+#{ Stubs
+
+
+class _OfflineVerificationClient(RecaptchaClient):
+
+    def __init__(self, verification_result=None):
+        super(_OfflineVerificationClient, self).__init__(
+            _FAKE_PRIVATE_KEY,
+            _FAKE_PUBLIC_KEY,
+            )
+
+        self.verification_result = verification_result
+        self.communication_attempts = 0
+
+    def _get_recaptcha_response_for_solution(
+        self,
+        solution_text_decoded,
+        challenge_id,
+        remote_ip,
+        ):
+
+        self.communication_attempts += 1
+
+        return self.verification_result
+
+
+class _ScriptedAPIClient(RecaptchaClient):
+
+    def __init__(self, responses_by_api_url, verification_timeout=None):
+        super(_ScriptedAPIClient, self).__init__(
+            _FAKE_PRIVATE_KEY,
+            _FAKE_PUBLIC_KEY,
+            verification_timeout=verification_timeout,
+            api_urls=[_PRIMARY_API_URL, _SECONDARY_API_URL],
+            )
+
+        self.responses_by_api_url = responses_by_api_url
+        self.contacted_hosts = []
+
+    def _get_recaptcha_response_from_api(
+        self,
+        verification_url,
+        request_data,
+        timeout,
+        ):
+        host = urlparse(verification_url).netloc
+        self.contacted_hosts.append(host)
+
+        api_url = 'http://{0}/recaptcha/api/'.format(host)
+        response = self.responses_by_api_url[api_url].pop(0)
+        if isinstance(response, SocketTimeout):
+            sleep(timeout)
+        if isinstance(response, Exception):
+            raise response
+        return response, False
+
+
+class _SlowVerificationClient(RecaptchaClient):
+    """
+    Client whose verifications are driven by the arguments: The solution text
+    is the error code (or "correct") and the challenge identifier is the number
+    of seconds the verification takes.
+
+    """
+
+    def __init__(self):
+        super(_SlowVerificationClient, self).__init__(
+            _FAKE_PRIVATE_KEY,
+            _FAKE_PUBLIC_KEY,
+            )
+
+        self.concurrent_verifications = 0
+        self.max_concurrent_verifications = 0
+        self._lock = Lock()
+
+    def _get_recaptcha_response_for_solution(
+        self,
+        solution_text_decoded,
+        challenge_id,
+        remote_ip,
+        ):
+        with self._lock:
+            self.concurrent_verifications += 1
+            self.max_concurrent_verifications = max(
+                self.max_concurrent_verifications,
+                self.concurrent_verifications,
+                )
+
+        sleep(float(challenge_id))
+
+        with self._lock:
+            self.concurrent_verifications -= 1
+
+        if solution_text_decoded == 'correct':
+            verification_result = _CORRECT_SOLUTION_RESULT
+        else:
+            verification_result = VerificationResult(
+                False,
+                solution_text_decoded,
+                0.1,
+                1,
+                False,
+                )
+        return verification_result
+
+
+class _DelayedResponsesClient(RecaptchaClient):
+
+    def __init__(
+        self,
+        delayed_responses,
+        hedging_delay=0.02,
+        hedging_ratio=1,
+        verification_timeout=None,
+        ):
+        super(_DelayedResponsesClient, self).__init__(
+            _FAKE_PRIVATE_KEY,
+            _FAKE_PUBLIC_KEY,
+            verification_timeout=verification_timeout,
+            hedging_delay=hedging_delay,
+            hedging_ratio=hedging_ratio,
+            )
+
+        self.delayed_responses = delayed_responses
+        self.timeouts = []
+
+    def _get_recaptcha_response_from_api(
+        self,
+        verification_url,
+        request_data,
+        timeout,
+        ):
+        self.timeouts.append(timeout)
+        delay, response = self.delayed_responses.pop(0)
+        sleep(delay)
+        if isinstance(response, Exception):
+            raise response
+        return response, False
+
+
+class _FakeVerificationServer(HTTPServer):
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _FakeVerificationHandler)
+
+        self.received_solution_texts = []
+
+    def handle_error(self, request, client_address):
+        # Clients time out and drop connections on purpose
+        pass
+
+
+class _FakeVerificationHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        request_body = self.rfile.read(int(self.headers['Content-Length']))
+        solution_text = parse_qs(request_body)['response'][0]
+
+        if self.path != '/verify':
+            response_status = 404
+            response_body = 'Not found'
+        elif solution_text == 'correct':
+            response_status = 200
+            response_body = 'true\nsuccess'
+        else:
+            response_status = 200
+            response_body = 'false\nincorrect-captcha-sol'
+
+        self.server.received_solution_texts.append(solution_text)
+        if solution_text == 'slow':
+            sleep(0.5)
+
+        self.send_response(response_status)
+        if solution_text == 'close':
+            self.send_header('Connection', 'close')
+            self.close_connection = 1
+        elif solution_text == 'close-silently':
+            self.close_connection = 1
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def log_message(self, *args):
+        pass
 
 
 class _SolutionCapturingClient(_OfflineVerificationClient):